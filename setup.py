@@ -15,7 +15,8 @@ setup(
     install_requires=[
         'wayround_i2p_utils',
         'regex',
-        'pyyaml'
+        'pyyaml',
+        'lxml'
         ],
     classifiers=[
         'License :: OSI Approved'
@@ -266,6 +266,18 @@ def mirrorer_work_on_dir(command_name, opts, args, adds):
 
         -mc=path - use specified mirroring config file instead of
             wrogts_mirrorer.conf.yaml under DIRNAME
+
+        --verify-all - recalculate checksums of all already downloaded
+            files, even if they are not changed since last run
+
+    download concurrency can be tuned by adding such entry to
+    wrogts_mirrorer.conf.yaml:
+
+    - download_scheduler:
+        max_connections: 4
+        max_connections_per_host: 2
+        retries: 3
+        retry_delay: 10
     """
 
     import wayround_i2p.getthesource.mirrorer
@@ -312,9 +324,13 @@ def mirrorer_work_on_dir(command_name, opts, args, adds):
         mirrorer = wayround_i2p.getthesource.mirrorer.Mirrorer(
             cfg,
             working_directory,
-            uriexplorer
+            uriexplorer,
+            verify_all='--verify-all' in opts
             )
-        ret = mirrorer.work_on_dir(mirrorer_cfg)
+        try:
+            ret = mirrorer.work_on_dir(mirrorer_cfg)
+        finally:
+            mirrorer.close()
 
     return ret
 
@@ -343,6 +359,7 @@ def simple_mirroring(command_name, opts, args, adds):
             [-XBR=filters]
             [-RR=filters]
             [-TBW=filters]
+            [--verify-all]
             URI [WORKDIRNAME]
 
         if WORKDIRNAME is not passed, current dir is used
@@ -373,6 +390,9 @@ def simple_mirroring(command_name, opts, args, adds):
         -mc=path - use specified mirroring config file instead of
             wrogts_mirrorer.conf.yaml under WORKDIRNAME
 
+        --verify-all - recalculate checksums of all already downloaded
+            files, even if they are not changed since last run
+
     """
 
     import wayround_i2p.getthesource.mirrorer
@@ -469,19 +489,117 @@ def simple_mirroring(command_name, opts, args, adds):
             cfg,
             working_directory,
             uriexplorer,
-            simple_config=simple_config
+            simple_config=simple_config,
+            verify_all='--verify-all' in opts
             )
 
-        ret = mirrorer.work_on_dir(mirrorer_cfg)
+        try:
+            ret = mirrorer.work_on_dir(mirrorer_cfg)
+        finally:
+            mirrorer.close()
 
     return ret
 
 
+def get_git_mirroring_opts(opts):
+    """
+    return: (ret, kwargs), where kwargs are for
+        git_tool.work_on_*_downloading_list() functions
+    """
+
+    ret = wayround_i2p.utils.getopt.check_options(
+        opts,
+        [
+            '-j=', '-jf=', '-ja=',
+            '--clone-mode=', '--clone-filter=', '--tags-only',
+            '--force-update'
+            ]
+        )
+
+    kwargs = {}
+
+    if ret == 0:
+        for opt_name, kwarg_name in [
+                ('-j', 'jobs'),
+                ('-jf', 'jobs_per_forge'),
+                ('-ja', 'archive_jobs')
+                ]:
+            if opt_name in opts:
+                try:
+                    kwargs[kwarg_name] = int(opts[opt_name])
+                except ValueError:
+                    logging.error(
+                        "{} value must be integer".format(opt_name)
+                        )
+                    ret = 1
+
+    if ret == 0:
+
+        clone_options = {}
+
+        if '--clone-mode' in opts:
+            clone_options['mode'] = opts['--clone-mode']
+            if clone_options['mode'] not in ['mirror', 'worktree']:
+                logging.error(
+                    "--clone-mode value must be `mirror' or `worktree'"
+                    )
+                ret = 1
+
+        if '--clone-filter' in opts:
+            clone_options['filter'] = opts['--clone-filter']
+
+        if '--tags-only' in opts:
+            clone_options['tags_only'] = True
+
+        if len(clone_options) != 0:
+            kwargs['clone_options'] = clone_options
+
+        if '--force-update' in opts:
+            kwargs['check_remote_refs'] = False
+
+    return ret, kwargs
+
+
 def mirror_github(command_name, opts, args, adds):
     """
 
     makes mirror of selected github projects. optionally careating archives.
 
+    SYNOPSIS
+        mirror-github [-j=N] [-jf=N] [-ja=N]
+            [--clone-mode=MODE] [--clone-filter=FILTER] [--tags-only]
+            [--force-update]
+            [WORKDIRNAME]
+
+    OPTIONS
+
+        -j=N - count of repositories updated simultaneously (default 8)
+
+        -jf=N - count of repositories updated simultaneously from one
+            forge (git server host) (default 4)
+
+        -ja=N - count of repositories archived simultaneously (default
+            is count of CPUs)
+
+        --clone-mode=MODE - `mirror' (default) - keep repositories bare
+            (without working tree) and update them with
+            `git fetch --prune --tags'. existing repositories with working
+            tree are converted. `worktree' - usual clone and `git pull'
+
+        --clone-filter=FILTER - partial clone filter for mirror mode,
+            like `blob:none'. file contents are then downloaded only for
+            archived tags
+
+        --tags-only - fetch only tags (mirror mode)
+
+        --force-update - by default, repository is not updated and
+            archived, if `git ls-remote' shows same refs as after last
+            successful run (and it's instructions are not changed). this
+            option disables the check
+
+    after all repositories are processed, summary with time spent on each
+    of them and list of failed ones is printed
+
     example of download_list.yaml:
 
     libgit2:
@@ -510,6 +628,14 @@ def mirror_github(command_name, opts, args, adds):
               tarball_format='tar.xz',      # format for created archives
               truncate_versions=3           # version truncation number
             }
+
+    clone options may be set for single repository, overriding command
+    line ones:
+
+    libgit2:
+      libgit2:
+        clone: {mode: mirror, filter: 'blob:none', tags_only: true}
+        make-tarballs: [libgit2]
     """
 
     import wayround_i2p.getthesource.git_tool
@@ -526,15 +652,26 @@ def mirror_github(command_name, opts, args, adds):
         'download_list.yaml'
         )
 
-    wayround_i2p.getthesource.git_tool.work_on_github_downloading_list(
-        working_dir,
-        list_file_path
-        )
+    ret, kwargs = get_git_mirroring_opts(opts)
+
+    if ret == 0:
+        git_tool = wayround_i2p.getthesource.git_tool
+        ret = git_tool.work_on_github_downloading_list(
+            working_dir,
+            list_file_path,
+            **kwargs
+            )
 
     return ret
 
 
 def mirror_gitlab(command_name, opts, args, adds):
+    """
+    same as mirror-github, but for gitlab projects
+    """
+
+    import wayround_i2p.getthesource.git_tool
+
     ret = 0
 
     working_dir = os.getcwd()
@@ -547,10 +684,15 @@ def mirror_gitlab(command_name, opts, args, adds):
         'download_list.yaml'
         )
 
-    wayround_i2p.getthesource.git_tool.work_on_gitlab_downloading_list(
-        working_dir,
-        list_file_path
-        )
+    ret, kwargs = get_git_mirroring_opts(opts)
+
+    if ret == 0:
+        git_tool = wayround_i2p.getthesource.git_tool
+        ret = git_tool.work_on_gitlab_downloading_list(
+            working_dir,
+            list_file_path,
+            **kwargs
+            )
 
     return ret
 
@@ -562,7 +704,8 @@ def mirror_git(command_name, opts, args, adds):
     and 3 item is target downloading instructions, like in mirror-github cmd
     can be none
 
-    see mirror-github help for description of third list item
+    see mirror-github help for description of third list item and
+    options
 
     example:
 
@@ -590,28 +733,75 @@ def mirror_git(command_name, opts, args, adds):
         'log.txt'
         )
 
-    f = open(log_file_path, 'w')
-    f.write("start: {}\n".format(datetime.datetime.now()))
-    f.flush()
+    ret, kwargs = get_git_mirroring_opts(opts)
 
-    wayround_i2p.getthesource.git_tool.work_on_git_downloading_list(
-        working_dir,
-        list_file_path
-        )
+    if ret == 0:
+
+        f = open(log_file_path, 'w')
+        f.write("start: {}\n".format(datetime.datetime.now()))
+        f.flush()
+
+        ret = wayround_i2p.getthesource.git_tool.work_on_git_downloading_list(
+            working_dir,
+            list_file_path,
+            **kwargs
+            )
 
-    f.write("end: {}\n".format(datetime.datetime.now()))
-    f.close()
+        f.write("end: {}\n".format(datetime.datetime.now()))
+        f.close()
 
     return ret
 
 
 def repo_do_work(command_name, opts, args, adds):
+    """
+    run upp.py or upp.sh scripts in current dir tree
+
+    SYNOPSIS
+        work-on-repo [-j=N] [-t=SECONDS] [-w=SECONDS]
+
+    OPTIONS
+
+        -j=N - count of simultaneously running scripts (default 4)
+
+        -t=SECONDS - kill script running longer (default 21600,
+            0 - no limit)
+
+        -w=SECONDS - skip directories, work on which successfully ended
+            less than this time ago (default 259200 - 3 days)
+    """
 
     import wayround_i2p.getthesource.repo_worker
 
-    ret = 0
-    path = os.path.abspath(os.getcwd())
-    ret = wayround_i2p.getthesource.repo_worker.work_on_source_repository(path)
+    ret = wayround_i2p.utils.getopt.check_options(
+        opts,
+        ['-j=', '-t=', '-w=']
+        )
+
+    kwargs = {}
+
+    if ret == 0:
+        for opt_name, kwarg_name in [
+                ('-j', 'jobs'),
+                ('-t', 'leaf_timeout'),
+                ('-w', 'staleness_window')
+                ]:
+            if opt_name in opts:
+                try:
+                    kwargs[kwarg_name] = int(opts[opt_name])
+                except ValueError:
+                    logging.error(
+                        "{} value must be integer".format(opt_name)
+                        )
+                    ret = 1
+
+    if ret == 0:
+        path = os.path.abspath(os.getcwd())
+        ret = wayround_i2p.getthesource.repo_worker.work_on_source_repository(
+            path,
+            **kwargs
+            )
+
     return ret
 
 
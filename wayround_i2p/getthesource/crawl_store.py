@@ -0,0 +1,202 @@
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+
+# NOTE: names of files written by
+#       wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler,
+#       which providers used before CrawlStore, like
+#       `(gnu.org)-(listdir)-(<sha1>)'
+_OLD_YAML_CACHE_NAME_RE = re.compile(r'^\([^()]+\)-\(')
+
+
+def remove_old_yaml_caches(cache_dir):
+    """
+    remove provider cache files of YAML format, which are not used since
+    crawl results are kept in CrawlStore
+
+    return: count of removed files
+    """
+
+    ret = 0
+
+    if os.path.isdir(cache_dir):
+        with os.scandir(cache_dir) as it:
+            for i in it:
+                if (_OLD_YAML_CACHE_NAME_RE.match(i.name) is not None
+                        and i.is_file(follow_symlinks=False)):
+                    os.unlink(i.path)
+                    ret += 1
+
+    return ret
+
+
+class CrawlStore:
+    """
+    Single file (SQLite) storage for provider crawl results: directory
+    listings, trees, tarball and basename lists.
+
+    Each record is identified by (namespace, kind, project, key), where
+    namespace is provider's crawl_store_namespace(), kind - name of
+    cached method. Data is stored as JSON together with expiration time
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            ' namespace TEXT NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' project TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' expires REAL NOT NULL,'
+            ' data TEXT,'
+            ' meta TEXT,'
+            ' PRIMARY KEY (namespace, kind, project, key)'
+            ')'
+            )
+
+        columns = [
+            x[1] for x in self._db.execute('PRAGMA table_info(records)')
+            ]
+        if 'meta' not in columns:
+            self._db.execute('ALTER TABLE records ADD COLUMN meta TEXT')
+
+        self._db.commit()
+
+        return
+
+    def _project_str(self, project):
+        ret = project
+        if ret is None:
+            ret = ''
+        return ret
+
+    def get(self, namespace, kind, project, key):
+        """
+        return: (data, expires, meta) or None if there is no such record.
+            expired records are returned too. meta is dict
+        """
+
+        ret = None
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data, expires, meta FROM records'
+                ' WHERE namespace = ? AND kind = ? AND project = ? AND key = ?',
+                (namespace, kind, self._project_str(project), key)
+                ).fetchone()
+
+        if row is not None:
+            meta = {}
+            if row[2] is not None:
+                meta = json.loads(row[2])
+            ret = json.loads(row[0]), row[1], meta
+
+        return ret
+
+    def set(self, namespace, kind, project, key, data, timeout, meta=None):
+        """
+        timeout - datetime.timedelta
+
+        meta - dict with additional information about data (like http
+            validators), which is stored but not returned as data
+        """
+
+        if meta is None:
+            meta = {}
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO records'
+                ' (namespace, kind, project, key, expires, data, meta)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    namespace,
+                    kind,
+                    self._project_str(project),
+                    key,
+                    time.time() + timeout.total_seconds(),
+                    json.dumps(data),
+                    json.dumps(meta)
+                    )
+                )
+            self._db.commit()
+
+        return
+
+    def touch(self, namespace, kind, project, key, timeout):
+        """
+        renew expiration time of record, leaving it's data as is
+        """
+
+        with self._lock:
+            self._db.execute(
+                'UPDATE records SET expires = ?'
+                ' WHERE namespace = ? AND kind = ? AND project = ? AND key = ?',
+                (
+                    time.time() + timeout.total_seconds(),
+                    namespace,
+                    kind,
+                    self._project_str(project),
+                    key
+                    )
+                )
+            self._db.commit()
+
+        return
+
+    def get_data_cache(
+            self,
+            namespace,
+            kind,
+            project,
+            key,
+            timeout,
+            freshdata_callback,
+            freshdata_callback_args=None,
+            freshdata_callback_kwargs=None
+            ):
+        """
+        return not expired stored data, or get it from freshdata_callback
+        and store
+        """
+
+        if freshdata_callback_args is None:
+            freshdata_callback_args = ()
+
+        if freshdata_callback_kwargs is None:
+            freshdata_callback_kwargs = {}
+
+        ret = None
+
+        res = self.get(namespace, kind, project, key)
+
+        if res is not None and res[1] > time.time():
+            ret = res[0]
+        else:
+            ret = freshdata_callback(
+                *freshdata_callback_args,
+                **freshdata_callback_kwargs
+                )
+            self.set(namespace, kind, project, key, ret, timeout)
+
+        return ret
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        return
@@ -0,0 +1,192 @@
+
+"""
+Fetching and parsing of HTTP(S) server generated directory index pages
+"""
+
+import logging
+import urllib.parse
+
+import lxml.html
+
+
+MAX_REDIRECTS = 10
+
+
+class ListingFetchResult:
+
+    def __init__(self):
+
+        # True - server answered 304 Not Modified to conditional request.
+        # folders, files and stats are None in this case
+        self.not_modified = False
+
+        # folders == files == None - means error
+        self.folders = None
+        self.files = None
+
+        # dict, in which keys are folder and file names and values are
+        # texts of rest of their row in index page (usually modification
+        # time and size), or None if row has no such text
+        self.stats = None
+
+        self.etag = None
+        self.last_modified = None
+
+        # provider specific listdir() result, made from this listing
+        self.result = None, None
+        return
+
+
+def parse_index_html(page_uri, page_data):
+    """
+    page_uri - uri of index page. links which are not pointing to direct
+        children of it are ignored
+
+    return: folders (list), files (list), stats (dict)
+    """
+
+    folders = []
+    files = []
+    stats = {}
+
+    page_path = urllib.parse.urlsplit(page_uri).path
+    if not page_path.endswith('/'):
+        page_path += '/'
+    page_path = urllib.parse.unquote(page_path)
+
+    doc = lxml.html.document_fromstring(page_data)
+
+    for a in doc.iter('a'):
+
+        href = a.get('href', None)
+        if href is None:
+            continue
+
+        split = urllib.parse.urlsplit(urllib.parse.urljoin(page_uri, href))
+
+        if split.query != '' or split.fragment != '':
+            continue
+
+        path = urllib.parse.unquote(split.path)
+
+        if not path.startswith(page_path):
+            continue
+
+        name = path[len(page_path):]
+
+        is_dir = name.endswith('/')
+        name = name.rstrip('/')
+
+        if name in ['', '.', '..'] or '/' in name:
+            continue
+
+        if name in stats:
+            continue
+
+        parent = a.getparent()
+        if parent is not None and parent.tag == 'td':
+            row = parent.getparent()
+            stat = ' '.join(
+                [
+                    x.text_content().strip()
+                    for x in row
+                    if x is not parent
+                    ]
+                ).strip()
+        else:
+            stat = (a.tail or '').split('\n')[0].strip()
+
+        if stat == '':
+            # NOTE: page has no modification time and size columns
+            stat = None
+
+        stats[name] = stat
+
+        if is_dir:
+            folders.append(name)
+        else:
+            files.append(name)
+
+    return folders, files, stats
+
+
+def fetch_listing(
+        pool,
+        page_uri,
+        etag=None,
+        last_modified=None,
+        ignore_invalid_connection_security=False,
+        logger=None
+        ):
+    """
+    get directory index page using pool (http_pool.ConnectionPool).
+
+    if etag or last_modified passed, request is made conditional, and
+    in case of unchanged page, result has not_modified == True
+
+    logger - errors are reported to it. if None, to root logger
+
+    return: ListingFetchResult
+    """
+
+    if logger is None:
+        logger = logging
+
+    ret = ListingFetchResult()
+
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    redirects = 0
+
+    while True:
+
+        try:
+            resp = pool.request(
+                'GET',
+                page_uri,
+                headers=headers,
+                ignore_invalid_connection_security=(
+                    ignore_invalid_connection_security
+                    )
+                )
+        except:
+            logger.exception("error getting {}".format(page_uri))
+            break
+
+        try:
+            if resp.status in [301, 302, 303, 307, 308]:
+                location = resp.getheader('Location', None)
+                resp.read()
+                redirects += 1
+                if location is not None and redirects <= MAX_REDIRECTS:
+                    page_uri = urllib.parse.urljoin(page_uri, location)
+                    continue
+
+            elif resp.status == 304:
+                resp.read()
+                ret.not_modified = True
+                ret.etag = etag
+                ret.last_modified = last_modified
+
+            elif resp.status == 200:
+                page_data = resp.read()
+                ret.etag = resp.getheader('ETag', None)
+                ret.last_modified = resp.getheader('Last-Modified', None)
+                ret.folders, ret.files, ret.stats = parse_index_html(
+                    page_uri,
+                    page_data
+                    )
+
+            else:
+                resp.read()
+
+        finally:
+            resp.release()
+
+        break
+
+    return ret
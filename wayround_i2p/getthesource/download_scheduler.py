@@ -0,0 +1,297 @@
+
+import time
+import heapq
+import itertools
+import threading
+import collections
+import urllib.parse
+
+
+def get_default_download_scheduler_cfg():
+    ret = {
+        # total count of simultaneous downloads
+        'max_connections': 4,
+
+        # count of simultaneous downloads from one host
+        'max_connections_per_host': 2,
+
+        # how many times failed download is restarted
+        'retries': 3,
+
+        # seconds to wait before first retry. each next wait is
+        # retry_delay_factor times longer
+        'retry_delay': 10,
+        'retry_delay_factor': 2
+        }
+    return ret
+
+
+class DownloadTask:
+
+    def __init__(
+            self,
+            downloader,
+            uri,
+            outputdir,
+            new_basename=None,
+            download_kwargs=None,
+            done_callback=None
+            ):
+        """
+        done_callback - callable, called with this task and download()
+            result after last attempt
+        """
+
+        if download_kwargs is None:
+            download_kwargs = {}
+
+        self.downloader = downloader
+        self.uri = uri
+        self.outputdir = outputdir
+        self.new_basename = new_basename
+        self.download_kwargs = download_kwargs
+        self.done_callback = done_callback
+
+        self.host = urllib.parse.urlsplit(uri).hostname
+        self.attempts = 0
+        self.result = None
+        return
+
+
+class DownloadScheduler:
+    """
+    Collects DownloadTask objects and runs them on pool of threads,
+    respecting total and per host connection limits
+    """
+
+    def __init__(self, logger, cfg=None):
+
+        _t = get_default_download_scheduler_cfg()
+        if isinstance(cfg, dict):
+            _t.update(cfg)
+        cfg = _t
+
+        self.logger = logger
+
+        self.max_connections = max(1, int(cfg['max_connections']))
+        self.max_connections_per_host = max(
+            1,
+            int(cfg['max_connections_per_host'])
+            )
+        self.retries = max(0, int(cfg['retries']))
+        self.retry_delay = cfg['retry_delay']
+        self.retry_delay_factor = cfg['retry_delay_factor']
+
+        self._lock = threading.Condition()
+
+        # NOTE: tasks are kept in separate queue for each host, so busy
+        #       host does not block tasks for other hosts
+        self._queues = collections.OrderedDict()
+        self._active = {}
+        self._running = 0
+
+        # NOTE: failed tasks waiting for retry: heap of
+        #       (not_before, seq, task). they don't occupy any worker or
+        #       host slot while waiting
+        self._delayed = []
+        self._delayed_seq = itertools.count()
+
+        self._failed = []
+        self._done_count = 0
+        self._total_count = 0
+
+        return
+
+    def add(self, task):
+        if not isinstance(task, DownloadTask):
+            raise TypeError("`task' must be inst of DownloadTask")
+
+        with self._lock:
+            if task.host not in self._queues:
+                self._queues[task.host] = collections.deque()
+                self._active[task.host] = 0
+            self._queues[task.host].append(task)
+            self._total_count += 1
+            self._lock.notify()
+        return
+
+    def _take(self):
+        """
+        must be called with self._lock held.
+
+        returns task or None if all host slots for queued tasks are
+        occupied or queued tasks are waiting for retry. in case there is
+        nothing to do at all, returns False
+        """
+
+        ret = None
+
+        now = time.monotonic()
+        while len(self._delayed) != 0 and self._delayed[0][0] <= now:
+            task = heapq.heappop(self._delayed)[2]
+            self._queues[task.host].append(task)
+
+        if self._running == 0 and len(self._delayed) == 0:
+            if sum([len(x) for x in self._queues.values()]) == 0:
+                ret = False
+
+        if ret is None:
+            for i in list(self._queues.keys()):
+                if (len(self._queues[i]) != 0
+                        and self._active[i] < self.max_connections_per_host):
+                    ret = self._queues[i].popleft()
+                    # NOTE: host is moved to the end, so hosts are
+                    #       served round robin
+                    self._queues.move_to_end(i)
+                    self._active[i] += 1
+                    break
+
+        return ret
+
+    def _worker(self):
+
+        while True:
+
+            with self._lock:
+                while True:
+                    task = self._take()
+                    if task is not None:
+                        break
+                    timeout = None
+                    if len(self._delayed) != 0:
+                        timeout = max(
+                            0,
+                            self._delayed[0][0] - time.monotonic()
+                            )
+                    self._lock.wait(timeout)
+
+                if task is False:
+                    self._lock.notify_all()
+                    break
+
+                self._running += 1
+
+            try:
+                self._perform(task)
+            except:
+                self.logger.exception(
+                    "error while downloading {}".format(task.uri)
+                    )
+                task.result = None
+
+            retry_delay = None
+
+            with self._lock:
+                self._running -= 1
+                if (not self._is_success(task.result)
+                        and task.attempts <= self.retries):
+                    retry_delay = self.retry_delay * (
+                        self.retry_delay_factor ** (task.attempts - 1)
+                        )
+                    heapq.heappush(
+                        self._delayed,
+                        (
+                            time.monotonic() + retry_delay,
+                            next(self._delayed_seq),
+                            task
+                            )
+                        )
+                else:
+                    self._done_count += 1
+                    if not self._is_success(task.result):
+                        self._failed.append(task)
+                self._lock.notify_all()
+
+            if retry_delay is not None:
+                self.logger.warning(
+                    "download of {} failed (attempt {} of {}),"
+                    " retrying in {} second(s)".format(
+                        task.uri,
+                        task.attempts,
+                        self.retries + 1,
+                        retry_delay
+                        )
+                    )
+                continue
+
+            if task.done_callback is not None:
+                try:
+                    task.done_callback(task, task.result)
+                except:
+                    self.logger.exception(
+                        "error in done callback for {}".format(task.uri)
+                        )
+
+        return
+
+    def _is_success(self, result):
+        return result is True
+
+    def _release_host(self, task):
+        with self._lock:
+            self._active[task.host] -= 1
+            self._lock.notify_all()
+        return
+
+    def _perform(self, task):
+        """
+        make one download attempt. retries are scheduled by _worker()
+        """
+
+        task.attempts += 1
+
+        try:
+            task.result = task.downloader.download(
+                task.uri,
+                task.outputdir,
+                new_basename=task.new_basename,
+                **task.download_kwargs
+                )
+        finally:
+            self._release_host(task)
+
+        return
+
+    def run(self):
+        """
+        perform all added tasks. tasks added while running are also done
+
+        return: 0 - all tasks succeeded, 1 - some tasks failed
+        """
+
+        ret = 0
+
+        self.logger.info(
+            "starting {} download(s) with {} connection(s),"
+            " {} per host".format(
+                self._total_count - self._done_count,
+                self.max_connections,
+                self.max_connections_per_host
+                )
+            )
+
+        threads = []
+        for i in range(self.max_connections):
+            t = threading.Thread(target=self._worker)
+            t.start()
+            threads.append(t)
+
+        for i in threads:
+            i.join()
+
+        self.logger.info(
+            "downloads finished: {} done, {} failed".format(
+                self._done_count,
+                len(self._failed)
+                )
+            )
+
+        for i in self._failed:
+            self.logger.error(
+                "  failed after {} attempt(s): {}".format(i.attempts, i.uri)
+                )
+
+        if len(self._failed) != 0:
+            ret = 1
+
+        return ret
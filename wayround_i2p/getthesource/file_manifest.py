@@ -0,0 +1,105 @@
+
+import os
+import sqlite3
+import threading
+
+
+class FileManifest:
+    """
+    Remembers checksums of mirrored files together with their stat()
+    values (size, mtime_ns, inode).
+
+    As long as file's stat() values are same as recorded, recorded
+    checksum is returned and file is not rehashed
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY,'
+            ' size INTEGER,'
+            ' mtime_ns INTEGER,'
+            ' inode INTEGER,'
+            ' method TEXT,'
+            ' checksum TEXT'
+            ')'
+            )
+        self._db.commit()
+
+        return
+
+    def get_checksum(self, path, method):
+        """
+        return: recorded checksum, or None if there is no record for given
+            method or file changed since it was recorded
+        """
+
+        ret = None
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None:
+            with self._lock:
+                row = self._db.execute(
+                    'SELECT size, mtime_ns, inode, method, checksum'
+                    ' FROM files WHERE path = ?',
+                    (path,)
+                    ).fetchone()
+
+            if (row is not None
+                    and row[0] == st.st_size
+                    and row[1] == st.st_mtime_ns
+                    and row[2] == st.st_ino
+                    and row[3] == method):
+                ret = row[4]
+
+        return ret
+
+    def set_checksum(self, path, method, checksum):
+        """
+        record checksum for file's current stat() values
+        """
+
+        st = os.stat(path)
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files'
+                ' (path, size, mtime_ns, inode, method, checksum)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    path,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ino,
+                    method,
+                    checksum
+                    )
+                )
+            self._db.commit()
+
+        return
+
+    def remove(self, path):
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+            self._db.commit()
+        return
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        return
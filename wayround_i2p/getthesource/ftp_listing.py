@@ -0,0 +1,305 @@
+
+"""
+Listing of FTP directories using pooled control connections
+"""
+
+import ftplib
+import logging
+import threading
+
+import regex
+
+import wayround_i2p.getthesource.dir_listing
+
+
+# NOTE: reply codes meaning server doesn't know or doesn't allow command
+MLSD_UNSUPPORTED_CODES = ['500', '501', '502', '504']
+
+# drwxr-xr-x   2 user  group   4096 Jan  1 12:00 name
+_UNIX_LIST_LINE_RE = regex.compile(
+    r'^(?P<type>[-dlbcps])\S*\s+.*?'
+    r'\s[A-Za-z]{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})\s'
+    r'(?P<name>.+)$'
+    )
+
+# 01-01-20  12:00PM       <DIR>          name
+_DOS_LIST_LINE_RE = regex.compile(
+    r'^\d{2}-\d{2}-\d{2,4}\s+\d{1,2}:\d{2}(?:[AaPp][Mm])?\s+'
+    r'(?P<size><DIR>|\d+)\s+(?P<name>.+)$'
+    )
+
+
+def parse_list_line(line):
+    """
+    parse line of LIST command output (unix `ls -l' or DOS style)
+
+    return: (name, is_dir), where is_dir is None for symbolic links (they
+        are to be checked separately), or None if line can't be parsed
+    """
+
+    ret = None
+
+    re_res = _UNIX_LIST_LINE_RE.match(line)
+    if re_res is not None:
+        name = re_res.group('name')
+        is_dir = re_res.group('type') == 'd'
+        if re_res.group('type') == 'l':
+            name = name.split(' -> ', 1)[0]
+            is_dir = None
+        ret = name, is_dir
+    else:
+        re_res = _DOS_LIST_LINE_RE.match(line)
+        if re_res is not None:
+            ret = re_res.group('name'), re_res.group('size') == '<DIR>'
+
+    return ret
+
+
+class FTPConnectionPool:
+    """
+    Keeps idle logged in ftplib.FTP control connections, separately for
+    each host + port. Connections dropped by server while idling are
+    replaced by new ones
+    """
+
+    def __init__(self, max_idle_per_host=4, timeout=60):
+
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        # NOTE: (host, port) of servers which refused MLSD
+        self._no_mlsd = set()
+
+        return
+
+    def get(self, host, port):
+        """
+        return: (ftp, reused)
+        """
+
+        ftp = None
+        with self._lock:
+            lst = self._idle.get((host, port), None)
+            if lst:
+                ftp = lst.pop()
+
+        if ftp is not None:
+            try:
+                ftp.voidcmd('NOOP')
+            except:
+                # NOTE: server closed idle connection
+                ftp.close()
+                ftp = None
+
+        reused = ftp is not None
+
+        if ftp is None:
+            ftp = ftplib.FTP()
+            try:
+                ftp.connect(host, port, timeout=self.timeout)
+                ftp.login()
+            except:
+                ftp.close()
+                raise
+
+        return ftp, reused
+
+    def put(self, host, port, ftp):
+        with self._lock:
+            if (host, port) not in self._idle:
+                self._idle[(host, port)] = []
+            if len(self._idle[(host, port)]) < self.max_idle_per_host:
+                self._idle[(host, port)].append(ftp)
+                ftp = None
+        if ftp is not None:
+            ftp.close()
+        return
+
+    def get_mlsd_supported(self, host, port):
+        with self._lock:
+            ret = (host, port) not in self._no_mlsd
+        return ret
+
+    def set_mlsd_unsupported(self, host, port):
+        with self._lock:
+            self._no_mlsd.add((host, port))
+        return
+
+    def close(self):
+        with self._lock:
+            for i in self._idle.values():
+                for j in i:
+                    j.close()
+            self._idle = {}
+        return
+
+
+def _is_dir(ftp, path):
+    ret = True
+    try:
+        ftp.cwd(path)
+    except ftplib.error_perm:
+        ret = False
+    return ret
+
+
+def _list_mlsd(ftp, path):
+    """
+    return: list of (name, is_dir)
+    """
+
+    ret = []
+
+    for name, facts in ftp.mlsd(path, facts=['type']):
+
+        name = name.rstrip('/').rsplit('/', 1)[-1]
+
+        type_ = facts.get('type', '').lower()
+
+        if type_ in ['cdir', 'pdir']:
+            continue
+
+        if type_ == 'dir':
+            is_dir = True
+        elif type_ == 'file':
+            is_dir = False
+        else:
+            # NOTE: links and other OS specific types
+            is_dir = None
+
+        ret.append((name, is_dir))
+
+    return ret
+
+
+def _list_list(ftp, path, logger):
+    """
+    return: list of (name, is_dir). if some LIST line is not understood,
+        falls back to NLST with checking of each entry
+    """
+
+    lines = []
+    ftp.retrlines('LIST {}'.format(path), lines.append)
+
+    ret = []
+
+    for i in lines:
+
+        if i.strip() == '' or i.startswith('total '):
+            continue
+
+        res = parse_list_line(i)
+        if res is None:
+            logger.warning(
+                "unknown LIST output format at {}: {}."
+                " checking each entry".format(path, i)
+                )
+            ret = [
+                (x.rstrip('/').rsplit('/', 1)[-1], None)
+                for x in ftp.nlst(path)
+                ]
+            break
+
+        ret.append(res)
+
+    return ret
+
+
+def _listdir(pool, ftp, host, port, path, logger):
+
+    ret = None
+
+    if pool.get_mlsd_supported(host, port):
+        try:
+            ret = _list_mlsd(ftp, path)
+        except ftplib.error_perm as e:
+            if str(e)[:3] not in MLSD_UNSUPPORTED_CODES:
+                raise
+            pool.set_mlsd_unsupported(host, port)
+
+    if ret is None:
+        ret = _list_list(ftp, path, logger)
+
+    lst = ret
+    ret = []
+
+    for name, is_dir in lst:
+
+        if name in ['', '.', '..']:
+            continue
+
+        if is_dir is None:
+            is_dir = _is_dir(ftp, '{}/{}'.format(path.rstrip('/'), name))
+
+        ret.append((name, is_dir))
+
+    return ret
+
+
+def fetch_listing(pool, host, port, path, logger=None):
+    """
+    list directory at path using control connection from pool
+    (FTPConnectionPool). files and directories are distinguished from
+    MLSD (or LIST) output, so no per-entry requests are made (except for
+    symbolic links).
+
+    if server dropped reused connection, listing is retried once with new
+    connection
+
+    logger - errors are reported to it. if None, to root logger
+
+    return: dir_listing.ListingFetchResult
+    """
+
+    if logger is None:
+        logger = logging
+
+    ret = wayround_i2p.getthesource.dir_listing.ListingFetchResult()
+
+    lst = None
+
+    while True:
+
+        try:
+            ftp, reused = pool.get(host, port)
+        except:
+            logger.exception(
+                "error connecting to ftp://{}:{}".format(host, port)
+                )
+            break
+
+        try:
+            lst = _listdir(pool, ftp, host, port, path, logger)
+        except (EOFError, OSError, ftplib.error_temp):
+            ftp.close()
+            if reused:
+                # NOTE: server closed idle connection after NOOP check.
+                #       retry with new one
+                continue
+            logger.exception(
+                "error listing ftp://{}:{}{}".format(host, port, path)
+                )
+        except ftplib.error_perm as e:
+            # NOTE: like `550 No such directory': connection is fine
+            logger.error(
+                "error listing ftp://{}:{}{}: {}".format(host, port, path, e)
+                )
+            pool.put(host, port, ftp)
+        except:
+            ftp.close()
+            logger.exception(
+                "error listing ftp://{}:{}{}".format(host, port, path)
+                )
+        else:
+            pool.put(host, port, ftp)
+
+        break
+
+    if lst is not None:
+        ret.folders = [x[0] for x in lst if x[1]]
+        ret.files = [x[0] for x in lst if not x[1]]
+
+    return ret
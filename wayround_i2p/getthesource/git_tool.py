@@ -2,8 +2,20 @@
 import subprocess
 import os.path
 import re
+import bz2
+import gzip
+import json
+import lzma
 import yaml
+import time
+import shutil
 import random
+import hashlib
+import functools
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
 
 import wayround_i2p.utils.path
 import wayround_i2p.utils.file
@@ -20,12 +32,322 @@ STD_TAG_RE = (
     )
 #STD_TAG_RE_C = re.compile(STD_TAG_RE)
 
+ARCHIVE_BUFFER_SIZE = 1024 ** 2
+
+# tarball_format -> (
+#     external compressor commands in order of preference (first found is
+#     used. multi-threaded ones go first),
+#     in-process compressor, used if none of commands found: callable
+#         which gets file object and returns file object compressing into
+#         it
+#     )
+ARCHIVE_COMPRESSORS = {
+    'tar.xz': (
+        [['xz', '-T0', '-c']],
+        lambda fileobj: lzma.LZMAFile(fileobj, 'wb')
+        ),
+    'tar.gz': (
+        [['pigz', '-n', '-c']],
+        lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0)
+        ),
+    'tar.bz2': (
+        [['lbzip2', '-c'], ['pbzip2', '-c']],
+        lambda fileobj: bz2.BZ2File(fileobj, 'wb')
+        ),
+    }
+ARCHIVE_COMPRESSORS['txz'] = ARCHIVE_COMPRESSORS['tar.xz']
+ARCHIVE_COMPRESSORS['tgz'] = ARCHIVE_COMPRESSORS['tar.gz']
+ARCHIVE_COMPRESSORS['tbz2'] = ARCHIVE_COMPRESSORS['tar.bz2']
+
+# NOTE: formats `git archive' writes without compressor
+GIT_ARCHIVE_FORMATS = ['tar', 'zip']
+
+
+def get_default_git_mirroring_cfg():
+    ret = {
+        # how many repositories are cloned/updated simultaneously
+        'jobs': 8,
+
+        # how many repositories are cloned/updated simultaneously from one
+        # forge (git server host)
+        'jobs_per_forge': 4,
+
+        # how many repositories are archived simultaneously
+        'archive_jobs': os.cpu_count() or 1,
+
+        # skip repositories, which refs on server (by `git ls-remote') are
+        # same as they were after last successful update and archiving
+        'check_remote_refs': True,
+
+        # default clone options. see clone_and_update(). can be overridden
+        # for repository by `clone' dict in it's instructions
+        'clone': {
+            'mode': 'mirror',
+            'filter': None,
+            'tags_only': False
+            }
+        }
+    return ret
+
+
+class RepoMirroringTask:
+
+    def __init__(
+            self,
+            name,
+            git_uri,
+            git_dir,
+            tarballs_dir,
+            instructions
+            ):
+        """
+        name - text used in messages and summary
+        instructions - target downloading instructions (see
+            work_on_instructions())
+        """
+
+        self.name = name
+        self.git_uri = git_uri
+        self.git_dir = git_dir
+        self.tarballs_dir = tarballs_dir
+        self.instructions = instructions
+
+        self.forge = get_forge(git_uri)
+
+        # None - not done, int - exit code
+        self.clone_result = None
+        self.archive_result = None
+
+        self.clone_time = 0.0
+        self.archive_time = 0.0
+        self.error = None
+
+        # clone_and_update() options used for this repository
+        self.clone_options = None
+
+        # result of get_remote_refs() made before update
+        self.remote_refs = None
+
+        # True - nothing changed since last run, so repository is not
+        # updated and archived
+        self.unchanged = False
+        return
+
+    def get_remote_refs_snapshot(self):
+        """
+        return: data to compare with saved one, to know if anything
+            changed since last run. normalized by JSON round trip
+        """
+        return json.loads(
+            json.dumps(
+                {
+                    'refs': self.remote_refs,
+                    'clone': self.clone_options,
+                    'instructions': self.instructions
+                    },
+                sort_keys=True
+                )
+            )
+
+    def get_is_failed(self):
+        return (self.error is not None
+                or self.clone_result != 0
+                or self.archive_result != 0)
+
+
+def get_forge(git_uri):
+    """
+    return: host name of git uri. scp-like uris (user@host:path) are
+        supported too
+    """
+    ret = urllib.parse.urlsplit(git_uri).hostname
+    if ret is None:
+        ret = git_uri.partition(':')[0].rpartition('@')[2]
+    return ret.lower()
+
+
+CLONE_MODES = ['mirror', 'worktree']
+
+
+def get_remote_refs(git_uri, no_check_certificate=False, tags_only=False):
+    """
+    get refs from server without fetching anything (`git ls-remote')
+
+    return: dict (ref name -> object id) or None in case of error
+    """
+
+    cmd = ['git']
+    if no_check_certificate:
+        cmd += ['-c', 'http.sslVerify=false']
+    cmd += ['ls-remote', '--tags']
+    if not tags_only:
+        cmd.append('--heads')
+    cmd.append(git_uri)
+
+    p = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        stdin=subprocess.DEVNULL
+        )
+    refs_txt = p.communicate()[0].decode('utf-8')
+
+    ret = None
+
+    if p.returncode == 0:
+        ret = {}
+        for i in refs_txt.splitlines():
+            object_id, _, refname = i.partition('\t')
+            if refname != '':
+                ret[refname] = object_id
+
+    return ret
+
+
+def get_remote_refs_snapshot_filename(git_dir):
+    return wayround_i2p.utils.path.join(
+        os.path.dirname(wayround_i2p.utils.path.abspath(git_dir)),
+        'remote_refs.json'
+        )
+
+
+def load_remote_refs_snapshot(git_dir):
+    """
+    return: data saved by save_remote_refs_snapshot() or None
+    """
+    ret = None
+    filename = get_remote_refs_snapshot_filename(git_dir)
+    if os.path.isfile(filename):
+        try:
+            with open(filename) as f:
+                ret = json.load(f)
+        except (OSError, ValueError):
+            ret = None
+    return ret
+
+
+def save_remote_refs_snapshot(git_dir, data):
+    filename = get_remote_refs_snapshot_filename(git_dir)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_filename, filename)
+    return
+
+
+def _git(args, cwd=None, no_check_certificate=False):
+    cmd = ['git']
+    if no_check_certificate:
+        cmd += ['-c', 'http.sslVerify=false']
+    cmd += args
+    p = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+        )
+    return p.wait()
+
+
+def is_bare_repository(git_dir):
+    return (not os.path.exists(os.path.join(git_dir, '.git'))
+            and os.path.isfile(os.path.join(git_dir, 'HEAD'))
+            and os.path.isdir(os.path.join(git_dir, 'objects')))
+
+
+def convert_to_bare(git_dir):
+    """
+    turn repository with working tree into bare one in place: git_dir/.git
+    becomes git_dir, working tree is removed
+
+    ret: 0 - ok
+    """
+
+    git_dir = wayround_i2p.utils.path.abspath(git_dir)
+
+    tmp_dir = git_dir + '.bare-tmp'
+
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    os.rename(os.path.join(git_dir, '.git'), tmp_dir)
+
+    ret = _git(['config', 'core.bare', 'true'], cwd=tmp_dir)
+
+    if ret == 0:
+        shutil.rmtree(git_dir)
+        os.rename(tmp_dir, git_dir)
+    else:
+        # NOTE: put it back
+        os.rename(tmp_dir, os.path.join(git_dir, '.git'))
+
+    return ret
+
+
+def _configure_mirror_remote(git_dir, git_uri, fetch_filter, tags_only):
+
+    ret = 0
+
+    refspecs = ['+refs/tags/*:refs/tags/*']
+    if not tags_only:
+        refspecs.insert(0, '+refs/heads/*:refs/heads/*')
+
+    commands = [
+        ['config', 'remote.origin.url', git_uri],
+        ['config', '--unset-all', 'remote.origin.fetch']
+        ]
+    for i in refspecs:
+        commands.append(['config', '--add', 'remote.origin.fetch', i])
+
+    if fetch_filter is not None:
+        commands += [
+            ['config', 'remote.origin.promisor', 'true'],
+            ['config', 'remote.origin.partialclonefilter', fetch_filter]
+            ]
+    else:
+        # NOTE: filter could be set by previous run
+        commands += [
+            ['config', '--unset', 'remote.origin.promisor'],
+            ['config', '--unset', 'remote.origin.partialclonefilter']
+            ]
+
+    for i in commands:
+        res = _git(i, cwd=git_dir)
+        # NOTE: 5 - nothing to unset
+        if res != 0 and not (
+                i[1] in ['--unset', '--unset-all'] and res == 5
+                ):
+            ret = res
+            break
+
+    return ret
+
 
 def clone_and_update(
         git_uri,
         output_dir,
-        no_check_certificate=False
+        no_check_certificate=False,
+        mode='mirror',
+        fetch_filter=None,
+        tags_only=False
         ):
+    """
+    mode - 'mirror' - keep bare repository, updated with
+        `git fetch --prune --tags'. existing repository with working tree
+        is converted to bare one. 'worktree' - usual clone, updated with
+        `git pull'
+
+    fetch_filter - (mirror mode only) partial clone filter, like
+        'blob:none'. file contents are then got from server only when
+        tag is archived
+
+    tags_only - (mirror mode only) fetch tags only, without branches
+
+    ret: 0 - ok
+    """
+
+    if mode not in CLONE_MODES:
+        raise ValueError("invalid clone mode: {}".format(mode))
 
     ret = 0
 
@@ -34,42 +356,464 @@ def clone_and_update(
     os.makedirs(output_dir, exist_ok=True)
 
     if wayround_i2p.utils.file.isdirempty(output_dir):
-        p = subprocess.Popen(
-            ['git', 'clone', git_uri, output_dir],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-            )
-        ret = p.wait()
-    else:
-        p = subprocess.Popen(
-            ['git', 'pull'],
+
+        if mode == 'worktree':
+            ret = _git(
+                ['clone', git_uri, output_dir],
+                no_check_certificate=no_check_certificate
+                )
+        else:
+            ret = _git(['init', '--bare', '--quiet', output_dir])
+            if ret == 0:
+                ret = _git(
+                    ['remote', 'add', 'origin', git_uri],
+                    cwd=output_dir
+                    )
+
+    elif mode == 'worktree' and not is_bare_repository(output_dir):
+        ret = _git(
+            ['pull'],
             cwd=output_dir,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
+            no_check_certificate=no_check_certificate
+            )
+
+    elif not is_bare_repository(output_dir):
+        print("  converting {} to bare repository".format(output_dir))
+        ret = convert_to_bare(output_dir)
+
+    if (ret == 0
+            and (mode == 'mirror' or is_bare_repository(output_dir))):
+
+        ret = _configure_mirror_remote(
+            output_dir,
+            git_uri,
+            fetch_filter,
+            tags_only
             )
-        ret = p.wait()
+
+        if ret == 0:
+            ret = _git(
+                ['fetch', '--prune', '--tags', 'origin'],
+                cwd=output_dir,
+                no_check_certificate=no_check_certificate
+                )
+
+    return ret
+
+
+def get_tag_refs(git_dir):
+    """
+    get all tags of repository by single `git for-each-ref' call
+
+    return: collections.OrderedDict, where keys are tag names and values
+        are dicts with keys:
+            'commit' - id of commit tag points to (annotated tags are
+                peeled). None if tag points not to commit (or to tag of
+                tag)
+            'date' - tagger date of annotated tag, or commit date of
+                lightweight one (unix time)
+    """
+
+    p = subprocess.Popen(
+        [
+            'git',
+            'for-each-ref',
+            '--format=%(refname)%00%(objecttype)%00%(objectname)'
+            '%00%(*objecttype)%00%(*objectname)%00%(creatordate:unix)',
+            'refs/tags'
+            ],
+        cwd=git_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+        )
+    refs_txt = p.communicate()[0].decode('utf-8')
+
+    ret = collections.OrderedDict()
+
+    for i in refs_txt.splitlines():
+
+        (refname, objecttype, objectname,
+         peeled_objecttype, peeled_objectname, date) = i.split('\0')
+
+        commit = None
+        if objecttype == 'commit':
+            commit = objectname
+        elif peeled_objecttype == 'commit':
+            commit = peeled_objectname
+
+        try:
+            date = int(date)
+        except ValueError:
+            date = None
+
+        ret[refname[len('refs/tags/'):]] = {
+            'commit': commit,
+            'date': date
+            }
 
     return ret
 
 
 def get_tags(git_dir):
+    return list(get_tag_refs(git_dir).keys())
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_re(pattern):
+    return re.compile(pattern)
+
+
+class RepoRefs:
+    """
+    Tags of repository, got once and shared by all make-tarballs
+    instructions of it, together with results of matching tags with
+    needed_tag_re patterns
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.tags = get_tag_refs(git_dir)
+        self._parsed = {}
+        return
+
+    def get_tag_commit(self, tag):
+        ret = None
+        if tag in self.tags:
+            ret = self.tags[tag]['commit']
+        if ret is None:
+            ret = get_tag_commit(self.git_dir, tag)
+        return ret
+
+    def parse_tags(self, needed_tag_re):
+        """
+        return: dict, where keys are names of tags matched by
+            needed_tag_re and values are (prefix, version, suffix)
+            tuples, with prefix and suffix stripped of '-._'
+        """
+
+        if needed_tag_re not in self._parsed:
+
+            needed_tag_re_c = _compile_re(needed_tag_re)
+
+            res = {}
+
+            for i in self.tags.keys():
+                re_res = needed_tag_re_c.match(i)
+                if re_res is not None:
+                    prefix = re_res.group('prefix')
+                    suffix = re_res.group('suffix')
+
+                    if prefix is None:
+                        prefix = ''
+
+                    if suffix is None:
+                        suffix = ''
+
+                    res[i] = (
+                        prefix.strip('-._'),
+                        re_res.group('version'),
+                        suffix.strip('-._')
+                        )
+
+            self._parsed[needed_tag_re] = res
+
+        return self._parsed[needed_tag_re]
+
+
+class ArchiveManifest:
+    """
+    Remembers for each archive made of repository: commit id of tag it
+    was made of, it's format, prefix and stat() values (size, mtime_ns,
+    inode) of archive file.
+
+    archive is known to be up to date, if all this values are same, so
+    it has not to be rehashed
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._data = {}
+        self._changed = False
+        self.load()
+        return
+
+    def load(self):
+        self._data = {}
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                print("  warning: can't read {}".format(self.filename))
+            else:
+                if isinstance(data, dict):
+                    self._data = data
+        self._changed = False
+        return
+
+    def save(self):
+        if self._changed:
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                json.dump(self._data, f, indent=1, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+            self._changed = False
+        return
+
+    def _stat_tuple(self, filename):
+        ret = None
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            pass
+        else:
+            ret = [st.st_size, st.st_mtime_ns, st.st_ino]
+        return ret
+
+    def is_up_to_date(self, output_filename, commit, tarball_format, prefix):
+        ret = False
+        rec = self._data.get(os.path.basename(output_filename), None)
+        if (rec is not None
+                and rec['commit'] == commit
+                and rec['format'] == tarball_format
+                and rec['prefix'] == prefix
+                and rec['stat'] == self._stat_tuple(output_filename)
+                and os.path.isfile(output_filename + '.sha512')):
+            ret = True
+        return ret
+
+    def set(self, output_filename, commit, tarball_format, prefix):
+        self._data[os.path.basename(output_filename)] = {
+            'commit': commit,
+            'format': tarball_format,
+            'prefix': prefix,
+            'stat': self._stat_tuple(output_filename)
+            }
+        self._changed = True
+        return
+
+
+def get_archive_manifest_filename(git_dir):
+    """
+    manifest is kept near the git dir (not in it and not in tarballs dir)
+    """
+    return wayround_i2p.utils.path.join(
+        os.path.dirname(wayround_i2p.utils.path.abspath(git_dir)),
+        'archive_manifest.json'
+        )
+
+
+def get_tag_commit(git_dir, tag):
+    """
+    return: commit id tag points to, or None
+    """
     p = subprocess.Popen(
-        ['git', 'tag'],
+        ['git', 'rev-parse', '--verify', '--quiet', tag + '^{commit}'],
         cwd=git_dir,
         stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL
         )
-    tags_txt = p.communicate()[0].decode('utf-8')
-    tags_txt = tags_txt.strip()
-    ret = tags_txt.split('\n')
+    ret = p.communicate()[0].decode('utf-8').strip()
+    if p.returncode != 0 or ret == '':
+        ret = None
     return ret
 
 
-def archive(git_dir, tag, output_filename, prefix):
+class _HashingWriter:
+
+    def __init__(self, fileobj, checksum_method='sha512'):
+        self.fileobj = fileobj
+        self.hasher = hashlib.new(checksum_method)
+        return
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        return self.fileobj.flush()
+
+
+def _get_compressor_command(tarball_format):
+    ret = None
+    for i in ARCHIVE_COMPRESSORS[tarball_format][0]:
+        if shutil.which(i[0]) is not None:
+            ret = i
+            break
+    return ret
+
+
+def write_archive(git_dir, tag, output_filename, prefix, tarball_format):
+    """
+    write archive of tag to output_filename.
+
+    `git archive' is not let to compress by itself (it's filters are
+    single threaded). tar stream is piped into external compressor
+    (multi-threaded one, if installed. see ARCHIVE_COMPRESSORS) or
+    compressed in-process. sha512 is calculated from same stream, so
+    written file is never reread
+
+    tarball_format - one of ARCHIVE_COMPRESSORS keys, 'tar' or 'zip'
+
+    output_filename is removed if archive is not written successfully
+
+    return: (exit code, sha512 hex string or None on error)
+    """
+
+    ret = 1, None
+
+    if (tarball_format not in ARCHIVE_COMPRESSORS
+            and tarball_format not in GIT_ARCHIVE_FORMATS):
+        print(
+            "  error: unsupported archive format `{}'".format(
+                tarball_format
+                )
+            )
+
+    else:
+
+        try:
+            ret = _write_archive(
+                git_dir,
+                tag,
+                output_filename,
+                prefix,
+                tarball_format
+                )
+        finally:
+            if ret[0] != 0:
+                print(
+                    "  error: can't write archive of `{}' ({})".format(
+                        tag,
+                        tarball_format
+                        )
+                    )
+                if os.path.isfile(output_filename):
+                    os.unlink(output_filename)
+                ret = ret[0], None
+
+    return ret
+
+
+def _write_archive(git_dir, tag, output_filename, prefix, tarball_format):
+
+    ret = 0
+
+    with open(output_filename, 'wb') as f:
+
+        writer = _HashingWriter(f)
+
+        if tarball_format in ARCHIVE_COMPRESSORS:
+            git_format = 'tar'
+            compressor_command = _get_compressor_command(tarball_format)
+        else:
+            # NOTE: GIT_ARCHIVE_FORMATS are written by git itself
+            git_format = tarball_format
+            compressor_command = None
+
+        cmd = [
+            'git',
+            'archive',
+            '--format={}'.format(git_format),
+            '--prefix={}/'.format(prefix),
+            tag
+            ]
+
+        p_git = subprocess.Popen(
+            cmd,
+            cwd=git_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+            )
+
+        p_compressor = None
+
+        try:
+            if compressor_command is not None:
+                p_compressor = subprocess.Popen(
+                    compressor_command,
+                    stdin=p_git.stdout,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                    )
+                # NOTE: so git gets SIGPIPE if compressor exits
+                p_git.stdout.close()
+                _copy_stream(p_compressor.stdout, writer)
+                p_compressor.stdout.close()
+
+            elif tarball_format in ARCHIVE_COMPRESSORS:
+                compressor = ARCHIVE_COMPRESSORS[tarball_format][1](writer)
+                with compressor:
+                    _copy_stream(p_git.stdout, compressor)
+                p_git.stdout.close()
+
+            else:
+                _copy_stream(p_git.stdout, writer)
+                p_git.stdout.close()
+
+        except:
+            # NOTE: nobody reads pipes anymore, so processes could hang
+            p_git.kill()
+            if p_compressor is not None:
+                p_compressor.kill()
+            raise
+
+        finally:
+            ret = p_git.wait()
+            if p_compressor is not None:
+                res = p_compressor.wait()
+                if ret == 0:
+                    ret = res
+
+    return ret, writer.hasher.hexdigest().lower()
+
+
+def _copy_stream(src, dst):
+    while True:
+        buf = src.read(ARCHIVE_BUFFER_SIZE)
+        if len(buf) == 0:
+            break
+        dst.write(buf)
+    return
+
+
+def archive(
+        git_dir,
+        tag,
+        output_filename,
+        prefix,
+        manifest=None,
+        commit=None
+        ):
+    """
+    manifest - ArchiveManifest. if passed, archive is not rehashed,
+        if manifest knows it is made of same commit and is not changed
+
+    commit - id of commit tag points to, if already known
+    """
+
     ret = 0
     sum_file_name = output_filename + '.sha512'
+
+    tarball_format = os.path.basename(output_filename)[len(prefix) + 1:]
+
+    if manifest is None:
+        commit = None
+    elif commit is None:
+        commit = get_tag_commit(git_dir, tag)
+
     do_write = False
-    if not os.path.isfile(sum_file_name):
+
+    if (commit is not None
+            and manifest.is_up_to_date(
+                output_filename,
+                commit,
+                tarball_format,
+                prefix
+                )):
+        pass
+
+    elif not os.path.isfile(sum_file_name):
         do_write = True
     else:
 
@@ -82,6 +826,10 @@ def archive(git_dir, tag, output_filename, prefix):
                 ).lower():
             do_write = True
 
+        elif commit is not None:
+            # NOTE: archive made before manifest existed
+            manifest.set(output_filename, commit, tarball_format, prefix)
+
     if do_write:
 
         print(
@@ -91,28 +839,27 @@ def archive(git_dir, tag, output_filename, prefix):
                 )
             )
 
-        cmd = ['git',
-               'archive',
-               '--prefix={}/'.format(prefix),
-               '-o', output_filename,
-               tag,
-               ]
+        tmp_filename = output_filename + '.tmp'
+
+        try:
+            ret, summ = write_archive(
+                git_dir,
+                tag,
+                tmp_filename,
+                prefix,
+                tarball_format
+                )
+            if ret == 0:
+                os.replace(tmp_filename, output_filename)
+        finally:
+            if os.path.isfile(tmp_filename):
+                os.unlink(tmp_filename)
 
-        p = subprocess.Popen(
-            cmd,
-            cwd=git_dir,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-            )
-        ret = p.wait()
         if ret == 0:
             with open(sum_file_name, 'w') as f:
-                f.write(
-                    wayround_i2p.utils.checksum.make_file_checksum(
-                        output_filename,
-                        'sha512'
-                        ).lower()
-                    )
+                f.write(summ)
+            if commit is not None:
+                manifest.set(output_filename, commit, tarball_format, prefix)
 
     return ret
 
@@ -125,8 +872,16 @@ def make_tarballs(
         needed_tag_re_suffix_is='^$',
         needed_tag_re=STD_TAG_RE,
         tarball_format='tar.xz',
-        truncate_versions=3
+        truncate_versions=3,
+        manifest=None,
+        refs=None
         ):
+    """
+    manifest - ArchiveManifest, passed to archive()
+
+    refs - RepoRefs. pass same object for all make_tarballs() calls on
+        repository, so tags are listed and parsed only once
+    """
 
     ret = 0
 
@@ -134,68 +889,36 @@ def make_tarballs(
 
     os.makedirs(output_dir, exist_ok=True)
 
-    tags = get_tags(git_dir)
+    if refs is None:
+        refs = RepoRefs(git_dir)
 
     basename_str = basename
 
-    # print("tags result for {} is: {}".format(git_dir, tags))
+    needed_tag_re_prefix_is_c = _compile_re(needed_tag_re_prefix_is)
+    needed_tag_re_suffix_is_c = _compile_re(needed_tag_re_suffix_is)
 
     acceptable_tags = {}
 
-    for i in tags:
-        re_res = re.match(needed_tag_re, i)
-        if re_res is not None:
-            prefix = re_res.group('prefix')
-            version = re_res.group('version')
-            delim = re_res.group('delim')
-            suffix = re_res.group('suffix')
-
-            if prefix is None:
-                prefix = ''
-
-            if suffix is None:
-                suffix = ''
+    for i, (prefix, version, suffix) in refs.parse_tags(
+            needed_tag_re
+            ).items():
 
-            if prefix is not None:
-                prefix = prefix.strip('-._')
+        if (needed_tag_re_prefix_is_c.match(prefix)
+                and needed_tag_re_suffix_is_c.match(suffix)):
 
-            if suffix is not None:
-                suffix = suffix.strip('-._')
-
-            '''
-            print('i: {}'.format(i))
-
-            print('re_res prefix: {}'.format(prefix))
-            print('re_res version: {}'.format(version))
-            print('re_res delim: {}'.format(delim))
-            print('re_res suffix: {}'.format(suffix))
-            print('-' * 20)
-            '''
-
-            if (
-                (
-                    prefix is not None
-                    and re.match(needed_tag_re_prefix_is, prefix)
-                    )
-                and (
-                    suffix is not None
-                    and re.match(needed_tag_re_suffix_is, suffix)
-                    )
-                    ):
+            version_str = version
+            for j in ['-', '_']:
+                version_str = version_str.replace(j, '.')
 
-                version_str = version
-                for j in ['-', '_']:
-                    version_str = version_str.replace(j, '.')
+            version_str = version_str.strip('-._')
 
-                version_str = version_str.strip('-._')
-
-                acceptable_tags[i] = {
-                    'tag': i,
-                    'prefix': prefix,
-                    'suffix': suffix,
-                    'version': version,
-                    'version_str': version_str
-                    }
+            acceptable_tags[i] = {
+                'tag': i,
+                'prefix': prefix,
+                'suffix': suffix,
+                'version': version,
+                'version_str': version_str
+                }
 
     acceptable_tag_versions2 = []
     for i in list(acceptable_tags.keys()):
@@ -209,7 +932,7 @@ def make_tarballs(
 
     wayround_i2p.utils.version.truncate_ver_tree(tree, truncate_versions)
 
-    acceptable_tag_versions2 = (
+    acceptable_tag_versions2 = set(
         wayround_i2p.utils.version.get_bases_from_ver_tree(
             tree,
             ['.tar.xz']
@@ -245,12 +968,15 @@ def make_tarballs(
             new_file_basename
             )
 
-        archive(
-            git_dir,
-            i,
-            output_filename,
-            basename_plus_version
-            )
+        if archive(
+                git_dir,
+                i,
+                output_filename,
+                basename_plus_version,
+                manifest=manifest,
+                commit=refs.get_tag_commit(i)
+                ) != 0:
+            ret = 1
 
     return ret
 
@@ -259,57 +985,63 @@ def work_on_github_downloading_list(
         work_dir,
         list_file_path,
         no_check_certificate=False,
-        verbose=True
+        verbose=True,
+        jobs=None,
+        jobs_per_forge=None,
+        archive_jobs=None,
+        clone_options=None,
+        check_remote_refs=None
         ):
-    list_file_path = wayround_i2p.utils.path.abspath(list_file_path)
-    work_dir = wayround_i2p.utils.path.abspath(work_dir)
-
-    with open(list_file_path) as f:
-        targets = yaml.load(f.read())
-
-    k1 = sorted(list(targets.keys()))
-    random.shuffle(k1)
-    for i in k1:
-        for j in sorted(list(targets[i].keys())):
-            if verbose:
-                print("mirroring {}:{}".format(i, j))
-
-            git_dir = wayround_i2p.utils.path.join(
-                work_dir,
-                i,
-                j,
-                'git'
-                )
-            tarballs_dir = wayround_i2p.utils.path.join(
-                work_dir,
-                i,
-                j,
-                'tarballs'
-                )
-
-            clone_and_update(
-                'https://github.com/{}/{}.git'.format(i, j),
-                git_dir,
-                no_check_certificate=no_check_certificate
-                )
+    return _work_on_forge_downloading_list(
+        'https://github.com/{}/{}.git',
+        work_dir,
+        list_file_path,
+        no_check_certificate=no_check_certificate,
+        verbose=verbose,
+        jobs=jobs,
+        jobs_per_forge=jobs_per_forge,
+        archive_jobs=archive_jobs,
+        clone_options=clone_options,
+        check_remote_refs=check_remote_refs
+        )
 
-            targets_i_j = targets[i][j]
 
-            work_on_instructions(
-                git_dir,
-                tarballs_dir,
-                targets_i_j,
-                "{}:{}".format(i, j)
-                )
-
-    return
+def work_on_gitlab_downloading_list(
+        work_dir,
+        list_file_path,
+        no_check_certificate=False,
+        verbose=True,
+        jobs=None,
+        jobs_per_forge=None,
+        archive_jobs=None,
+        clone_options=None,
+        check_remote_refs=None
+        ):
+    return _work_on_forge_downloading_list(
+        'https://gitlab.com/{}/{}.git',
+        work_dir,
+        list_file_path,
+        no_check_certificate=no_check_certificate,
+        verbose=verbose,
+        jobs=jobs,
+        jobs_per_forge=jobs_per_forge,
+        archive_jobs=archive_jobs,
+        clone_options=clone_options,
+        check_remote_refs=check_remote_refs
+        )
 
 
-def work_on_gitlab_downloading_list(
+def _work_on_forge_downloading_list(
+        uri_template,
         work_dir,
         list_file_path,
         no_check_certificate=False,
-        verbose=True
+        verbose=True,
+        jobs=None,
+        jobs_per_forge=None,
+        archive_jobs=None,
+        clone_options=None,
+        check_remote_refs=None
         ):
     list_file_path = wayround_i2p.utils.path.abspath(list_file_path)
     work_dir = wayround_i2p.utils.path.abspath(work_dir)
@@ -317,12 +1049,12 @@ def work_on_gitlab_downloading_list(
     with open(list_file_path) as f:
         targets = yaml.load(f.read())
 
+    tasks = []
+
     k1 = sorted(list(targets.keys()))
     random.shuffle(k1)
     for i in k1:
         for j in sorted(list(targets[i].keys())):
-            if verbose:
-                print("mirroring {}:{}".format(i, j))
 
             git_dir = wayround_i2p.utils.path.join(
                 work_dir,
@@ -337,28 +1069,40 @@ def work_on_gitlab_downloading_list(
                 'tarballs'
                 )
 
-            clone_and_update(
-                'https://gitlab.com/{}/{}.git'.format(i, j),
-                git_dir,
-                no_check_certificate=no_check_certificate
+            tasks.append(
+                RepoMirroringTask(
+                    "{}:{}".format(i, j),
+                    uri_template.format(i, j),
+                    git_dir,
+                    tarballs_dir,
+                    targets[i][j]
+                    )
                 )
 
-            targets_i_j = targets[i][j]
-
-            work_on_instructions(
-                git_dir,
-                tarballs_dir,
-                targets_i_j,
-                "{}:{}".format(i, j)
-                )
+    ret = mirror_repositories(
+        tasks,
+        no_check_certificate=no_check_certificate,
+        verbose=verbose,
+        jobs=jobs,
+        jobs_per_forge=jobs_per_forge,
+        archive_jobs=archive_jobs,
+        clone_options=clone_options,
+        check_remote_refs=check_remote_refs
+        )
 
-    return
+    return ret
 
 
 def work_on_git_downloading_list(
         work_dir,
         list_file_path,
-        no_check_certificate=False
+        no_check_certificate=False,
+        verbose=True,
+        jobs=None,
+        jobs_per_forge=None,
+        archive_jobs=None,
+        clone_options=None,
+        check_remote_refs=None
         ):
     list_file_path = wayround_i2p.utils.path.abspath(list_file_path)
     work_dir = wayround_i2p.utils.path.abspath(work_dir)
@@ -366,6 +1110,8 @@ def work_on_git_downloading_list(
     with open(list_file_path) as f:
         targets = yaml.load(f.read())
 
+    tasks = []
+
     for i in targets:
 
         git_dir = wayround_i2p.utils.path.join(
@@ -380,21 +1126,265 @@ def work_on_git_downloading_list(
             'tarballs'
             )
 
-        clone_and_update(
-            i[0],
-            git_dir,
-            no_check_certificate=no_check_certificate
+        tasks.append(
+            RepoMirroringTask(
+                repr(i),
+                i[0],
+                git_dir,
+                tarballs_dir,
+                i[2]
+                )
             )
 
-        targets_i_2 = i[2]
+    ret = mirror_repositories(
+        tasks,
+        no_check_certificate=no_check_certificate,
+        verbose=verbose,
+        jobs=jobs,
+        jobs_per_forge=jobs_per_forge,
+        archive_jobs=archive_jobs,
+        clone_options=clone_options,
+        check_remote_refs=check_remote_refs
+        )
 
-        work_on_instructions(
-            git_dir,
-            tarballs_dir,
-            targets_i_2,
-            repr(i)
+    return ret
+
+
+def mirror_repositories(
+        tasks,
+        no_check_certificate=False,
+        verbose=True,
+        jobs=None,
+        jobs_per_forge=None,
+        archive_jobs=None,
+        clone_options=None,
+        check_remote_refs=None
+        ):
+    """
+    clone/update repositories of tasks (list of RepoMirroringTask)
+    concurrently and make tarballs of each repository as soon as it is
+    updated.
+
+    cloning is network bound, so it's done by pool of `jobs' threads,
+    but not more than `jobs_per_forge' for one forge. archiving is CPU
+    bound and is done by separate pool of `archive_jobs' threads, so it
+    does not hold cloning slots. None values are taken from
+    get_default_git_mirroring_cfg()
+
+    clone_options - dict, overriding default `clone' options of
+        get_default_git_mirroring_cfg() for all repositories (see
+        clone_and_update() for meaning of them). repository's own `clone'
+        instruction overrides both
+
+    check_remote_refs - True - repositories, which refs on server are
+        same as after last successful run (and which instructions are not
+        changed), are neither updated, nor archived
+
+    in the end summary with time spent on each repository and list of
+    failed ones is printed
+
+    ret: 0 - no errors, 1 - some repositories failed
+    """
+
+    cfg = get_default_git_mirroring_cfg()
+
+    if jobs is None:
+        jobs = cfg['jobs']
+
+    if jobs_per_forge is None:
+        jobs_per_forge = cfg['jobs_per_forge']
+
+    if archive_jobs is None:
+        archive_jobs = cfg['archive_jobs']
+
+    jobs = max(1, int(jobs))
+    jobs_per_forge = max(1, int(jobs_per_forge))
+    archive_jobs = max(1, int(archive_jobs))
+
+    if check_remote_refs is None:
+        check_remote_refs = cfg['check_remote_refs']
+
+    default_clone_options = cfg['clone']
+    if clone_options is not None:
+        default_clone_options.update(clone_options)
+
+    ret = 0
+
+    started = time.monotonic()
+
+    forge_semaphores = {}
+
+    # NOTE: tasks are submitted interleaved by forge, so threads waiting
+    #       for slot of one busy forge do not occupy whole clone pool
+    by_forge = collections.OrderedDict()
+    for i in tasks:
+        if i.forge not in by_forge:
+            by_forge[i.forge] = collections.deque()
+            forge_semaphores[i.forge] = threading.BoundedSemaphore(
+                jobs_per_forge
+                )
+        by_forge[i.forge].append(i)
+
+    ordered_tasks = []
+    while len(by_forge) != 0:
+        for i in list(by_forge.keys()):
+            ordered_tasks.append(by_forge[i].popleft())
+            if len(by_forge[i]) == 0:
+                del by_forge[i]
+
+    archive_futures = []
+    archive_futures_lock = threading.Lock()
+
+    def archive_job(task):
+        if verbose:
+            print("making tarballs of {}".format(task.name))
+        t = time.monotonic()
+        try:
+            task.archive_result = work_on_instructions(
+                task.git_dir,
+                task.tarballs_dir,
+                task.instructions,
+                task.name
+                )
+        except Exception as e:
+            task.error = e
+            task.archive_result = 1
+        task.archive_time = time.monotonic() - t
+
+        if (task.remote_refs is not None
+                and task.clone_result == 0
+                and task.archive_result == 0):
+            save_remote_refs_snapshot(
+                task.git_dir,
+                task.get_remote_refs_snapshot()
+                )
+        return
+
+    def clone_job(task):
+        with forge_semaphores[task.forge]:
+            if verbose:
+                print("mirroring {}".format(task.name))
+            t = time.monotonic()
+            try:
+                task.clone_options = dict(default_clone_options)
+                if isinstance(task.instructions, dict):
+                    task.clone_options.update(
+                        task.instructions.get('clone', None) or {}
+                        )
+
+                if check_remote_refs:
+                    task.remote_refs = get_remote_refs(
+                        task.git_uri,
+                        no_check_certificate=no_check_certificate,
+                        tags_only=task.clone_options['tags_only']
+                        )
+                    if (task.remote_refs is not None
+                            and os.path.isdir(task.git_dir)
+                            and not wayround_i2p.utils.file.isdirempty(
+                                task.git_dir
+                                )
+                            and load_remote_refs_snapshot(task.git_dir)
+                            == task.get_remote_refs_snapshot()):
+                        task.unchanged = True
+                        task.clone_result = 0
+                        task.archive_result = 0
+
+                if not task.unchanged:
+                    task.clone_result = clone_and_update(
+                        task.git_uri,
+                        task.git_dir,
+                        no_check_certificate=no_check_certificate,
+                        mode=task.clone_options['mode'],
+                        fetch_filter=task.clone_options['filter'],
+                        tags_only=task.clone_options['tags_only']
+                        )
+            except Exception as e:
+                task.error = e
+                task.clone_result = 1
+            task.clone_time = time.monotonic() - t
+
+        # NOTE: tarballs are made from what repository has, even if
+        #       update failed
+        if task.error is None and not task.unchanged:
+            with archive_futures_lock:
+                archive_futures.append(
+                    archive_executor.submit(archive_job, task)
+                    )
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=archive_jobs
+            ) as archive_executor:
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs
+                ) as clone_executor:
+
+            concurrent.futures.wait(
+                [clone_executor.submit(clone_job, i) for i in ordered_tasks]
+                )
+
+        with archive_futures_lock:
+            concurrent.futures.wait(archive_futures)
+
+    print_mirroring_summary(tasks, time.monotonic() - started)
+
+    for i in tasks:
+        if i.get_is_failed():
+            ret = 1
+            break
+
+    return ret
+
+
+def print_mirroring_summary(tasks, total_time):
+
+    print("mirroring summary:")
+
+    for i in sorted(
+            tasks,
+            key=lambda x: x.clone_time + x.archive_time,
+            reverse=True
+            ):
+        print(
+            "  {:>8.1f}s (update {:.1f}s, archive {:.1f}s)"
+            " {}{}".format(
+                i.clone_time + i.archive_time,
+                i.clone_time,
+                i.archive_time,
+                i.name,
+                ' [FAILED]' if i.get_is_failed() else (
+                    ' [unchanged]' if i.unchanged else ''
+                    )
+                )
             )
 
+    failed = [x for x in tasks if x.get_is_failed()]
+
+    if len(failed) != 0:
+        print("failed ({}):".format(len(failed)))
+        for i in failed:
+            reason = []
+            if i.clone_result != 0:
+                reason.append("update exit code: {}".format(i.clone_result))
+            if i.archive_result not in [0, None]:
+                reason.append(
+                    "archive exit code: {}".format(i.archive_result)
+                    )
+            if i.error is not None:
+                reason.append("error: {}".format(i.error))
+            print("  {}: {}".format(i.name, ', '.join(reason)))
+
+    print(
+        "repositories: {}, unchanged: {}, failed: {},"
+        " total time: {:.1f}s".format(
+            len(tasks),
+            len([x for x in tasks if x.unchanged]),
+            len(failed),
+            total_time
+            )
+        )
+
     return
 
 
@@ -416,24 +1406,42 @@ def work_on_instructions(
         'make-tarballs', []
         )
 
+    manifest = ArchiveManifest(get_archive_manifest_filename(git_dir))
+
+    refs = None
+
     if isinstance(make_tarballs_instructions, list):
-        for i in make_tarballs_instructions:
-            if isinstance(i, dict):
-                make_tarballs(
-                    git_dir,
-                    tarballs_dir,
-                    **i
-                    )
-            elif isinstance(i, str):
-                make_tarballs(
-                    git_dir,
-                    tarballs_dir,
-                    basename=i
-                    )
-            else:
-                raise TypeError(
-                    "invalid type of download descr at {}".format(path_txt)
-                    )
+        try:
+            for i in make_tarballs_instructions:
+                if refs is None:
+                    refs = RepoRefs(git_dir)
+                if isinstance(i, dict):
+                    res = make_tarballs(
+                        git_dir,
+                        tarballs_dir,
+                        manifest=manifest,
+                        refs=refs,
+                        **i
+                        )
+                elif isinstance(i, str):
+                    res = make_tarballs(
+                        git_dir,
+                        tarballs_dir,
+                        basename=i,
+                        manifest=manifest,
+                        refs=refs
+                        )
+                else:
+                    raise TypeError(
+                        "invalid type of download descr at {}".format(
+                            path_txt
+                            )
+                        )
+                if res != 0:
+                    errors = True
+        finally:
+            manifest.save()
+
     if errors:
         ret = 1
 
@@ -0,0 +1,212 @@
+
+import ssl
+import threading
+import http.client
+import urllib.parse
+
+
+DEFAULT_USER_AGENT = 'wrogts'
+
+
+class PooledResponse:
+    """
+    Wrapper around http.client.HTTPResponse. release() must be called
+    when response is no longer needed, so connection could be reused
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._released = False
+
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        return
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def release(self):
+        """
+        return connection to pool. if response body is not read till the
+        end - connection is closed instead
+        """
+        if not self._released:
+            self._released = True
+            if (self.response.isclosed()
+                    and not self.response.will_close):
+                self._pool._put(self._key, self._conn)
+            else:
+                self._conn.close()
+        return
+
+    def close(self):
+        """
+        close connection without returning it to pool
+        """
+        if not self._released:
+            self._released = True
+            self._conn.close()
+        return
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive http.client connections, separately for each
+    scheme + host + port (and certificate checking mode)
+    """
+
+    def __init__(
+            self,
+            max_idle_per_host=4,
+            timeout=60,
+            user_agent=DEFAULT_USER_AGENT
+            ):
+
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.user_agent = user_agent
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        self._ssl_contexts = {}
+
+        return
+
+    def _get_ssl_context(self, ignore_invalid_connection_security):
+        with self._lock:
+            if ignore_invalid_connection_security not in self._ssl_contexts:
+                ctx = ssl.create_default_context()
+                if ignore_invalid_connection_security:
+                    ctx.check_hostname = False
+                    ctx.verify_mode = ssl.CERT_NONE
+                self._ssl_contexts[ignore_invalid_connection_security] = ctx
+            ret = self._ssl_contexts[ignore_invalid_connection_security]
+        return ret
+
+    def _new_conn(self, key):
+        scheme, host, port, ignore_invalid_connection_security = key
+        if scheme == 'https':
+            ret = http.client.HTTPSConnection(
+                host,
+                port,
+                timeout=self.timeout,
+                context=self._get_ssl_context(
+                    ignore_invalid_connection_security
+                    )
+                )
+        elif scheme == 'http':
+            ret = http.client.HTTPConnection(
+                host,
+                port,
+                timeout=self.timeout
+                )
+        else:
+            raise ValueError("unsupported scheme: {}".format(scheme))
+        return ret
+
+    def _get(self, key):
+        """
+        return: (conn, reused)
+        """
+        conn = None
+        with self._lock:
+            lst = self._idle.get(key, None)
+            if lst:
+                conn = lst.pop()
+        reused = conn is not None
+        if conn is None:
+            conn = self._new_conn(key)
+        return conn, reused
+
+    def _put(self, key, conn):
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = []
+            if len(self._idle[key]) < self.max_idle_per_host:
+                self._idle[key].append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+        return
+
+    def request(
+            self,
+            method,
+            uri,
+            headers=None,
+            ignore_invalid_connection_security=False
+            ):
+        """
+        perform request using idle connection to uri's host if there is
+        one. connections closed by server while idling are replaced by new
+        ones transparently
+
+        return: PooledResponse
+        """
+
+        if headers is None:
+            headers = {}
+
+        headers = dict(headers)
+        headers.setdefault('User-Agent', self.user_agent)
+
+        split = urllib.parse.urlsplit(uri)
+
+        scheme = split.scheme.lower()
+        port = split.port
+        if port is None:
+            port = 443 if scheme == 'https' else 80
+
+        key = (
+            scheme,
+            split.hostname,
+            port,
+            ignore_invalid_connection_security
+            )
+
+        # NOTE: already escaped chars are left as is
+        target = urllib.parse.quote(split.path, safe="/%:@!$&'()*+,;=~")
+        if target == '':
+            target = '/'
+        if split.query != '':
+            target += '?' + split.query
+
+        while True:
+            conn, reused = self._get(key)
+            try:
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+            except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError
+                    ):
+                conn.close()
+                if reused:
+                    # NOTE: server closed idle keep-alive connection.
+                    #       retry with other one
+                    continue
+                raise
+            except:
+                conn.close()
+                raise
+            break
+
+        ret = PooledResponse(self, key, conn, response)
+
+        return ret
+
+    def close(self):
+        with self._lock:
+            for i in self._idle.values():
+                for j in i:
+                    j.close()
+            self._idle = {}
+        return
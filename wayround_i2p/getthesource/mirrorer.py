@@ -12,6 +12,9 @@ import wayround_i2p.utils.uri
 import wayround_i2p.utils.list
 
 import wayround_i2p.getthesource.uriexplorer
+import wayround_i2p.getthesource.download_scheduler
+import wayround_i2p.getthesource.file_manifest
+import wayround_i2p.getthesource.path_filter
 
 
 def get_default_mirroring_cfg():
@@ -28,11 +31,64 @@ def get_default_mirroring_cfg():
 
         'downloader_obfuscation_required': False,
         'redownload_prevention_checksum': 'sha512',
+
+        # name of module in modules/downloaders: 'wget' or 'native'
+        'downloader': 'wget',
         # 'separate_dirs_by_bases': True
         }
     return ret
 
 
+# NOTE: files with this suffixes are sidecars of tarballs and never
+#       considered for deletion
+TARBALL_SIDECAR_SUFFIXES = tuple(
+    wayround_i2p.utils.tarball.KNOWN_SIGNING_EXTENSIONS
+    + ['.sha1', '.sha512', '.sha224', '.sha256', '.sha384', '.md5']
+    )
+
+
+def select_tarballs_by_basenames(needed_tarballs, bases):
+    """
+    return items of needed_tarballs, which paths ends with one of bases.
+    result is ordered by bases, then by needed_tarballs
+    """
+
+    index = {}
+    for i in needed_tarballs:
+        head, sep, tail = i[0].rpartition('/')
+        if sep == '':
+            continue
+        if tail not in index:
+            index[tail] = []
+        index[tail].append(i)
+
+    ret = []
+    for i in bases:
+        ret += index.get(i, [])
+
+    return ret
+
+
+def select_tarballs_to_delete(output_path, bases):
+    """
+    return names of files in output_path, which are not in bases and
+    are not sidecars (signatures and checksums)
+    """
+
+    bases = set(bases)
+
+    ret = []
+
+    with os.scandir(output_path) as it:
+        for i in it:
+            if i.name.endswith(TARBALL_SIDECAR_SUFFIXES):
+                continue
+            if i.name not in bases and i.is_file():
+                ret.append(i.name)
+
+    return ret
+
+
 class Mirrorer:
 
     def __init__(
@@ -40,8 +96,14 @@ class Mirrorer:
             cfg,
             working_path,
             uriexplorer,
-            simple_config=None
+            simple_config=None,
+            verify_all=False
             ):
+        """
+        verify_all - if True, checksums of all already mirrored files are
+            recalculated, instead of trusting FileManifest records of
+            files which's stat() values are not changed
+        """
 
         working_path = wayround_i2p.utils.path.abspath(working_path)
 
@@ -63,14 +125,42 @@ class Mirrorer:
 
         self.simple_config = simple_config
 
+        self.verify_all = verify_all
+
+        # NOTE: filter text -> path_filter.FilterRules (or None)
+        self._filter_rules = {}
+
+        self.file_manifest = (
+            wayround_i2p.getthesource.file_manifest.FileManifest(
+                wayround_i2p.utils.path.join(
+                    self.working_path,
+                    'wrogts-manifest.sqlite'
+                    )
+                )
+            )
+
         self.uriexplorer = uriexplorer
 
         self.downloaders = []
 
         self._load_downloaders_list()
 
+        self._downloader_objects = {}
+
         self.pers_prov_obj = None
 
+        self.download_scheduler = None
+
+        return
+
+    def close(self):
+        """
+        close downloaders (and connections they keep) and file manifest
+        """
+        for i in self._downloader_objects.values():
+            i.close()
+        self._downloader_objects = {}
+        self.file_manifest.close()
         return
 
     def _load_downloaders_list(self):
@@ -98,22 +188,60 @@ class Mirrorer:
         return
 
     def get_downloader(self, name):
+        """
+        downloader objects are created once and then reused, so
+        downloaders can keep connections between downloads
+        """
         ret = None
-        if name in self.downloaders:
+        if name in self._downloader_objects:
+            ret = self._downloader_objects[name]
+        elif name in self.downloaders:
             mod = importlib.import_module(
                 'wayround_i2p.getthesource.modules.downloaders.{}'.format(name)
                 )
             p = mod.Downloader(self)
             if p.get_is_downloader_enabled():
                 ret = p
+                self._downloader_objects[name] = ret
 
         return ret
 
     def work_on_dir(self, m_cfg=None):
+        """
+        m_cfg - list of dicts. each dict is ether mirroring target:
+
+            {provider_name: str, project_names: list, mirroring_opt: dict}
+
+            or download scheduler options (see
+            download_scheduler.get_default_download_scheduler_cfg()):
+
+            {download_scheduler: {max_connections: 4,
+                                  max_connections_per_host: 2,
+                                  retries: 3, retry_delay: 10}}
+
+        downloads of all targets are collected first and then done by
+        single DownloadScheduler
+        """
+        try:
+            ret = self._work_on_dir(m_cfg)
+        finally:
+            # NOTE: downloads are done (or abandoned), so direct calls to
+            #       perform_mirroring() and work_on_dir_with_basename()
+            #       must not add tasks to this scheduler
+            self.download_scheduler = None
+        return ret
+
+    def _work_on_dir(self, m_cfg):
         ret = 0
 
         path = self.working_path
 
+        self.download_scheduler = (
+            wayround_i2p.getthesource.download_scheduler.DownloadScheduler(
+                self.logger
+                )
+            )
+
         if self.simple_config is not None:
             provider_name = 'std_simple'
             project_names = None
@@ -160,8 +288,21 @@ class Mirrorer:
 
             if ret == 0:
 
+                for i in m_cfg:
+                    if 'download_scheduler' in i:
+                        self.download_scheduler = (
+                            wayround_i2p.getthesource.download_scheduler.
+                            DownloadScheduler(
+                                self.logger,
+                                i['download_scheduler']
+                                )
+                            )
+
                 for i in m_cfg:
 
+                    if 'download_scheduler' in i and 'provider_name' not in i:
+                        continue
+
                     provider_name = i.get('provider_name', None)
                     if provider_name is None:
                         self.logger.error("provider name should be supplied")
@@ -183,6 +324,38 @@ class Mirrorer:
                             mirroring_options
                             ) != 0:
                         ret = 2
+
+        if ret != 1:
+            if self.download_scheduler.run() != 0 and ret == 0:
+                ret = 4
+
+        return ret
+
+    def _run_with_download_scheduler(self, func, *args, **kwargs):
+        """
+        call func. if there is no active download scheduler, new one is
+        made for this call and downloads scheduled by func are performed
+        after it returns
+
+        return: func result, or 4 if func succeeded, but downloads failed
+        """
+
+        if self.download_scheduler is not None:
+            ret = func(*args, **kwargs)
+        else:
+            self.download_scheduler = (
+                wayround_i2p.getthesource.download_scheduler.
+                DownloadScheduler(
+                    self.logger
+                    )
+                )
+            try:
+                ret = func(*args, **kwargs)
+                if self.download_scheduler.run() != 0 and ret == 0:
+                    ret = 4
+            finally:
+                self.download_scheduler = None
+
         return ret
 
     def perform_mirroring(
@@ -192,6 +365,25 @@ class Mirrorer:
             project_names,
             mirroring_options
             ):
+        """
+        if called not from work_on_dir(), scheduled downloads are done
+        before return
+        """
+        return self._run_with_download_scheduler(
+            self._perform_mirroring,
+            path,
+            provider_name,
+            project_names,
+            mirroring_options
+            )
+
+    def _perform_mirroring(
+            self,
+            path,
+            provider_name,
+            project_names,
+            mirroring_options
+            ):
 
         ret = 0
 
@@ -228,18 +420,40 @@ class Mirrorer:
 
             for project_name in sorted(project_names):
 
-                basenames = provider_obj.basenames(project_name)
+                self.logger.info(
+                    "getting list of tarballs for `{}:{}'".format(
+                        provider_name,
+                        project_name
+                        )
+                    )
+
+                tarballs_index = provider_obj.tarballs_by_basename(
+                    project_name
+                    )
+
+                self.logger.info(
+                    "  got {} basename(s)".format(len(tarballs_index))
+                    )
 
-                for basename in sorted(basenames):
+                tarballs_index = self.apply_filters_by_basename(
+                    tarballs_index,
+                    mirroring_options.get('filter_lines', [])
+                    )
+
+                for basename in sorted(tarballs_index.keys()):
                     if self.work_on_dir_with_basename(
                             path,
                             provider_name,
                             project_name,
                             basename,
-                            mirroring_options
+                            mirroring_options,
+                            needed_tarballs=tarballs_index[basename],
+                            filters_applied=True
                             ) != 0:
                         ret = 3
 
+                del tarballs_index
+
         return ret
 
     def work_on_dir_with_basename(
@@ -248,7 +462,41 @@ class Mirrorer:
             provider,
             project,
             basename,
-            options
+            options,
+            needed_tarballs=None,
+            filters_applied=False
+            ):
+        """
+        needed_tarballs - list of provider's tarballs() items with given
+            basename. if None - it's taken from provider's
+            tarballs_by_basename()
+
+        filters_applied - True if options['filter_lines'] are already
+            applied to needed_tarballs (see apply_filters_by_basename())
+
+        if called not from work_on_dir(), scheduled downloads are done
+        before return
+        """
+        return self._run_with_download_scheduler(
+            self._work_on_dir_with_basename,
+            path,
+            provider,
+            project,
+            basename,
+            options,
+            needed_tarballs=needed_tarballs,
+            filters_applied=filters_applied
+            )
+
+    def _work_on_dir_with_basename(
+            self,
+            path,
+            provider,
+            project,
+            basename,
+            options,
+            needed_tarballs=None,
+            filters_applied=False
             ):
 
         ret = 0
@@ -290,33 +538,34 @@ class Mirrorer:
 
         os.makedirs(output_path, exist_ok=True)
 
-        self.logger.info(
-            "  getting list of tarballs for `{}:{}'".format(provider, project)
-            )
-        tarballs = provider_obj.tarballs(project)  # [provider][]
-        self.logger.info("    got {} item(s)".format(len(tarballs)))
-
-        needed_tarballs = []
-
-        self.logger.info(
-            "  filtering tarballs list for `{}' basename".format(basename)
-            )
+        if needed_tarballs is None:
+            self.logger.info(
+                "  getting list of tarballs for `{}:{}'".format(
+                    provider,
+                    project
+                    )
+                )
+            needed_tarballs = provider_obj.tarballs_by_basename(
+                project
+                ).get(basename, [])
 
-        for i in tarballs:
-            parse_result = wayround_i2p.utils.tarball.parse_tarball_name(i[0])
-            if parse_result is None:
-                continue
-            if parse_result['groups']['name'] == basename:
-                needed_tarballs.append(i)
+        if not filters_applied:
 
-        needed_tarballs = self.apply_filters(
-            needed_tarballs,
-            options.get('filter_lines', [])
-            )
+            self.logger.info(
+                "  filtering {} tarball(s) of `{}' basename".format(
+                    len(needed_tarballs),
+                    basename
+                    )
+                )
 
-        self.logger.info("    got {} item(s)".format(len(needed_tarballs)))
+            needed_tarballs = self.apply_filters(
+                needed_tarballs,
+                options.get('filter_lines', [])
+                )
 
-        del tarballs
+            self.logger.info(
+                "    got {} item(s)".format(len(needed_tarballs))
+                )
 
         only_latests = options.get('only_latests', 3)
 
@@ -356,35 +605,15 @@ class Mirrorer:
 
             self.logger.info("    got {} item(s)".format(len(bases)))
 
-            tarballs_to_download = []
-            for i in bases:
-                # print('i: {}'.format(i))
-                for j in needed_tarballs:
-                    # print('j[0]: {}'.format(j[0]))
-                    if j[0].endswith('/' + i):
-                        tarballs_to_download.append(j)
-
-            tarballs_to_delete = []
-            for i in os.listdir(output_path):
-                j_found = False
-                for j in (
-                        wayround_i2p.utils.tarball.KNOWN_SIGNING_EXTENSIONS
-                        + ['.sha1', '.sha512', '.sha224', '.sha256', '.sha384'
-                            '.md5'
-                           ]
-                        ):
-                    if i.endswith(j):
-                        j_found = True
-                        break
-                if j_found:
-                    continue
-
-                ij = wayround_i2p.utils.path.join(output_path, i)
+            tarballs_to_download = select_tarballs_by_basenames(
+                needed_tarballs,
+                bases
+                )
 
-                if os.path.isfile(ij):
-                    # print("is i in bases?: {}, {}, {}".format(i in bases, i, bases))
-                    if i not in bases:
-                        tarballs_to_delete.append(i)
+            tarballs_to_delete = select_tarballs_to_delete(
+                output_path,
+                bases
+                )
 
             self.logger.info(
                 "  {} file(s) are marked for download: {}".format(
@@ -402,8 +631,13 @@ class Mirrorer:
 
             # print("tarballs_to_download: {}".format(tarballs_to_download))
 
-            # TODO: here must be something smarter, but I'm in horry
-            downloader = self.get_downloader('wget')
+            downloader = self.get_downloader(options['downloader'])
+            if downloader is None:
+                self.logger.error(
+                    "can't get downloader `{}'".format(options['downloader'])
+                    )
+                tarballs_to_download = []
+                ret = 4
             for i in tarballs_to_download:
                 new_basename = os.path.basename(i[0])
                 new_basename_full = wayround_i2p.utils.path.join(
@@ -418,10 +652,24 @@ class Mirrorer:
                 saved_cs = None
 
                 if os.path.isfile(new_basename_full):
-                    actual_cs = wayround_i2p.utils.checksum.make_file_checksum(
-                        new_basename_full,
-                        options['redownload_prevention_checksum']
-                        )
+                    if not self.verify_all:
+                        actual_cs = self.file_manifest.get_checksum(
+                            new_basename_full,
+                            options['redownload_prevention_checksum']
+                            )
+                    if actual_cs is None:
+                        actual_cs = (
+                            wayround_i2p.utils.checksum.make_file_checksum(
+                                new_basename_full,
+                                options['redownload_prevention_checksum']
+                                )
+                            )
+                        if isinstance(actual_cs, str):
+                            self.file_manifest.set_checksum(
+                                new_basename_full,
+                                options['redownload_prevention_checksum'],
+                                actual_cs.lower()
+                                )
                     if isinstance(actual_cs, str):
                         actual_cs = actual_cs.lower()
                         if os.path.isfile(new_basename_full_cs):
@@ -446,29 +694,38 @@ class Mirrorer:
                     if os.path.isfile(new_basename_full_cs):
                         os.unlink(new_basename_full_cs)
 
-                    dd_res = downloader.download(
-                        i[1],
-                        output_path,
-                        new_basename=new_basename,
-                        stop_event=None,
-                        ignore_invalid_connection_security=(
-                            options['ignore_invalid_connection_security']
-                            ),
-                        downloader_obfuscation_required=(
-                            options['downloader_obfuscation_required']
+                    checksum_callback, checksum_writer = (
+                        self._get_checksum_writer(
+                            new_basename_full,
+                            options['redownload_prevention_checksum']
                             )
                         )
 
-                    if dd_res == 0:
-                        actual_cs = (
-                            wayround_i2p.utils.checksum.make_file_checksum(
-                                new_basename_full,
-                                options['redownload_prevention_checksum']
-                                )
+                    self.download_scheduler.add(
+                        wayround_i2p.getthesource.download_scheduler.
+                        DownloadTask(
+                            downloader,
+                            i[1],
+                            output_path,
+                            new_basename=new_basename,
+                            download_kwargs=dict(
+                                stop_event=None,
+                                ignore_invalid_connection_security=(
+                                    options[
+                                        'ignore_invalid_connection_security'
+                                        ]
+                                    ),
+                                downloader_obfuscation_required=(
+                                    options['downloader_obfuscation_required']
+                                    ),
+                                checksum_method=(
+                                    options['redownload_prevention_checksum']
+                                    ),
+                                checksum_callback=checksum_callback
+                                ),
+                            done_callback=checksum_writer
                             )
-                        actual_cs = actual_cs.lower()
-                        with open(new_basename_full_cs, 'w') as f:
-                            f.write(actual_cs)
+                        )
 
                 for j in wayround_i2p.utils.tarball.KNOWN_SIGNING_EXTENSIONS:
                     # TODO: this is disabled, as generates too many unneeded
@@ -504,7 +761,7 @@ class Mirrorer:
                                 )
                             )
 
-                        if dd_res != 0:
+                        if dd_res is not True:
                             if os.path.isfile(jj):
                                 os.unlink(jj)
 
@@ -517,6 +774,58 @@ class Mirrorer:
 
         return ret
 
+    def _get_checksum_writer(self, filename, checksum_method):
+        """
+        returns (checksum_callback, done_callback) pair. first one is for
+        downloader, which calculates checksum while downloading, second -
+        for DownloadTask. done_callback writes checksum sidecar file after
+        successful download. file is reread only if downloader not passed
+        checksum
+        """
+
+        received = {}
+
+        def checksum_callback(checksum):
+            received['checksum'] = checksum
+            return
+
+        def checksum_writer(task, result):
+            if result is True:
+                actual_cs = received.get('checksum', None)
+                if actual_cs is None:
+                    actual_cs = (
+                        wayround_i2p.utils.checksum.make_file_checksum(
+                            filename,
+                            checksum_method
+                            )
+                        )
+                actual_cs = actual_cs.lower()
+                with open('{}.{}'.format(filename, checksum_method), 'w') as f:
+                    f.write(actual_cs)
+                self.file_manifest.set_checksum(
+                    filename,
+                    checksum_method,
+                    actual_cs
+                    )
+            return
+
+        return checksum_callback, checksum_writer
+
+    def _get_filter_rules(self, filter_text):
+        """
+        path_filter.compile_filter_lines() result, compiled once for each
+        filter text
+        """
+
+        if filter_text not in self._filter_rules:
+            self._filter_rules[filter_text] = (
+                wayround_i2p.getthesource.path_filter.compile_filter_lines(
+                    filter_text
+                    )
+                )
+
+        return self._filter_rules[filter_text]
+
     def apply_filters(
             self,
             needed_tarballs,
@@ -531,12 +840,17 @@ class Mirrorer:
         if isinstance(filter_text_or_lines, list):
             filter_text_or_lines = '\n'.join(filter_text_or_lines)
 
-        lst = set(
-            wayround_i2p.utils.list.filter_list(
-                [x[0] for x in needed_tarballs],
-                filter_text_or_lines
+        rules = self._get_filter_rules(filter_text_or_lines)
+
+        if rules is not None:
+            lst = set(rules.filter([x[0] for x in needed_tarballs]))
+        else:
+            lst = set(
+                wayround_i2p.utils.list.filter_list(
+                    [x[0] for x in needed_tarballs],
+                    filter_text_or_lines
+                    )
                 )
-            )
 
         ret = []
 
@@ -545,3 +859,44 @@ class Mirrorer:
                 ret.append(i)
 
         return ret
+
+    def apply_filters_by_basename(
+            self,
+            tarballs_index,
+            filter_text_or_lines
+            ):
+        """
+        apply_filters() to all items of tarballs_by_basename() result in
+        single pass instead of once per basename
+
+        return: new dict with same keys
+        """
+
+        all_tarballs = []
+        for i in tarballs_index.values():
+            all_tarballs += i
+
+        self.logger.info(
+            "  filtering {} tarball(s) of {} basename(s)".format(
+                len(all_tarballs),
+                len(tarballs_index)
+                )
+            )
+
+        lst = set(
+            [
+                x[0] for x in self.apply_filters(
+                    all_tarballs,
+                    filter_text_or_lines
+                    )
+                ]
+            )
+
+        self.logger.info("    got {} item(s)".format(len(lst)))
+
+        ret = {}
+
+        for key, value in tarballs_index.items():
+            ret[key] = [x for x in value if x[0] in lst]
+
+        return ret
@@ -0,0 +1,473 @@
+
+import os.path
+import ftplib
+import shutil
+import hashlib
+import urllib.parse
+
+import wayround_i2p.utils.path
+
+import wayround_i2p.getthesource.mirrorer
+import wayround_i2p.getthesource.http_pool
+import wayround_i2p.getthesource.ftp_listing
+
+
+BUFFER_SIZE = 256 * 1024
+
+MAX_REDIRECTS = 10
+
+
+def parse_content_range(value):
+    """
+    parse `bytes <start>-<end>/<total>' value of Content-Range header
+
+    return: (start, end, total) or None if value is not understood.
+        total is None if it's `*'
+    """
+
+    ret = None
+
+    unit, _, rng = value.strip().partition(' ')
+    rng, _, total = rng.partition('/')
+    start, _, end = rng.partition('-')
+
+    if (unit.lower() == 'bytes'
+            and start.isdigit()
+            and end.isdigit()
+            and (total.isdigit() or total == '*')):
+        if total == '*':
+            total = None
+        else:
+            total = int(total)
+        ret = int(start), int(end), total
+
+    return ret
+
+
+class PartFile:
+    """
+    File being downloaded. Checksum of it's content is updated with each
+    write, so complete file never need to be reread for checksumming
+    """
+
+    def __init__(self, filename, checksum_method=None):
+        self.filename = filename
+        self.checksum_method = checksum_method
+        self.hasher = None
+        self.size = 0
+        self._file = None
+        return
+
+    def existing_size(self):
+        ret = 0
+        if os.path.isfile(self.filename):
+            ret = os.stat(self.filename).st_size
+        return ret
+
+    def open(self, resume=True):
+        """
+        resume - True - continue existing file (it's content is hashed
+            now), False - start from empty file
+        """
+
+        self.close()
+
+        self.size = 0
+        self.hasher = None
+        if self.checksum_method is not None:
+            self.hasher = hashlib.new(self.checksum_method)
+
+        if resume and os.path.isfile(self.filename):
+            self._file = open(self.filename, 'r+b')
+            while True:
+                buf = self._file.read(BUFFER_SIZE)
+                if len(buf) == 0:
+                    break
+                if self.hasher is not None:
+                    self.hasher.update(buf)
+                self.size += len(buf)
+        else:
+            self._file = open(self.filename, 'wb')
+
+        return
+
+    def write(self, data):
+        self._file.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+        self.size += len(data)
+        return
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return
+
+    def remove(self):
+        self.close()
+        if os.path.isfile(self.filename):
+            os.unlink(self.filename)
+        return
+
+    def hexdigest(self):
+        ret = None
+        if self.hasher is not None:
+            ret = self.hasher.hexdigest().lower()
+        return ret
+
+
+class Downloader:
+    """
+    In-process HTTP(S)/FTP downloader.
+
+    Connections are kept alive and reused for next downloads from same
+    host. Like `wget -c', existing file is continued. Data is written to
+    `.part' file, which is renamed to target name only when download is
+    complete. existing target file is left untouched if download fails
+    """
+
+    def __init__(self, controller):
+        if not isinstance(
+                controller,
+                wayround_i2p.getthesource.mirrorer.Mirrorer
+                ):
+            raise TypeError(
+                "`controller' must be inst of "
+                "wayround_i2p.getthesource.mirrorer.Mirrorer"
+                )
+        self.controller = controller
+        self.logger = self.controller.logger
+
+        self.pool = wayround_i2p.getthesource.http_pool.ConnectionPool()
+
+        self.ftp_pool = (
+            wayround_i2p.getthesource.ftp_listing.FTPConnectionPool()
+            )
+
+        return
+
+    def close(self):
+        """
+        close kept connections
+        """
+        self.pool.close()
+        self.ftp_pool.close()
+        return
+
+    def get_downloader_name(self):
+        return 'Native HTTP(S)/FTP'
+
+    def get_downloader_code_name(self):
+        return 'native'
+
+    def get_supported_schemas(self):
+        return ['http', 'https', 'ftp']
+
+    def get_is_downloader_enabled(self):
+        return True
+
+    def download(
+            self,
+            uri,
+            outputdir,
+            new_basename=None,
+            stop_event=None,
+            ignore_invalid_connection_security=False,
+            downloader_obfuscation_required=False,
+            checksum_method=None,
+            checksum_callback=None
+            ):
+        """
+        return: True - ok, None - error, False - ok, but download not completed
+
+        checksum_method - hashlib algorithm name. if passed, checksum of
+            downloaded file is passed to checksum_callback as lower case hex
+            string after successful download
+        """
+
+        ret = None
+
+        scheme = urllib.parse.urlsplit(uri).scheme.lower()
+
+        if new_basename is None:
+            new_basename = os.path.basename(
+                urllib.parse.unquote(urllib.parse.urlsplit(uri).path)
+                )
+
+        output_filename = wayround_i2p.utils.path.join(
+            outputdir,
+            new_basename
+            )
+
+        part = PartFile(output_filename + '.part', checksum_method)
+
+        if scheme not in self.get_supported_schemas():
+            self.logger.error("unsupported uri scheme: {}".format(uri))
+        else:
+
+            os.makedirs(outputdir, exist_ok=True)
+
+            # NOTE: file left by previous incomplete download (or by wget)
+            #       is continued. it's copy is continued, so original stays
+            #       in place until download succeeds
+            copied_size = None
+            if (not os.path.isfile(part.filename)
+                    and os.path.isfile(output_filename)):
+                shutil.copyfile(output_filename, part.filename)
+                copied_size = os.stat(part.filename).st_size
+
+            self.logger.info("downloading: {}".format(uri))
+
+            try:
+                if scheme == 'ftp':
+                    ret = self._download_ftp(uri, part, stop_event)
+                else:
+                    ret = self._download_http(
+                        uri,
+                        part,
+                        stop_event,
+                        ignore_invalid_connection_security
+                        )
+            except:
+                self.logger.exception("error downloading {}".format(uri))
+                ret = None
+            finally:
+                part.close()
+
+            if ret is True:
+                os.replace(part.filename, output_filename)
+                self.logger.info(
+                    "downloaded: {} ({} bytes)".format(uri, part.size)
+                    )
+                if checksum_callback is not None and part.hasher is not None:
+                    checksum_callback(part.hexdigest())
+            elif (copied_size is not None
+                    and part.existing_size() == copied_size):
+                # NOTE: nothing is got, copy of original is not needed
+                part.remove()
+
+        return ret
+
+    def _stream(self, read_func, part, stop_event):
+        ret = True
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                ret = False
+                break
+            buf = read_func(BUFFER_SIZE)
+            if len(buf) == 0:
+                break
+            part.write(buf)
+        return ret
+
+    def _download_http(
+            self,
+            uri,
+            part,
+            stop_event,
+            ignore_invalid_connection_security
+            ):
+
+        ret = None
+
+        redirects = 0
+
+        while True:
+
+            headers = {}
+
+            existing_size = part.existing_size()
+            if existing_size != 0:
+                headers['Range'] = 'bytes={}-'.format(existing_size)
+
+            resp = self.pool.request(
+                'GET',
+                uri,
+                headers=headers,
+                ignore_invalid_connection_security=(
+                    ignore_invalid_connection_security
+                    )
+                )
+
+            try:
+
+                if resp.status in [301, 302, 303, 307, 308]:
+                    location = resp.getheader('Location', None)
+                    resp.read()
+                    redirects += 1
+                    if location is None or redirects > MAX_REDIRECTS:
+                        self.logger.error(
+                            "invalid or too many redirects: {}".format(uri)
+                            )
+                        break
+                    uri = urllib.parse.urljoin(uri, location)
+                    continue
+
+                if resp.status == 416 and existing_size != 0:
+                    resp.read()
+                    content_range = resp.getheader('Content-Range', '')
+                    if content_range == 'bytes */{}'.format(existing_size):
+                        # NOTE: file is already complete
+                        part.open(resume=True)
+                        ret = True
+                        break
+                    self.logger.warning(
+                        "server refused to continue {}. restarting".format(
+                            uri
+                            )
+                        )
+                    part.remove()
+                    redirects += 1
+                    if redirects > MAX_REDIRECTS:
+                        break
+                    continue
+
+                content_range = None
+                if resp.status == 206:
+                    content_range = parse_content_range(
+                        resp.getheader('Content-Range', '')
+                        )
+
+                if resp.status == 206 and (
+                        content_range is None
+                        or content_range[0] != existing_size):
+                    if content_range is not None and content_range[0] == 0:
+                        part.open(resume=False)
+                    else:
+                        self.logger.warning(
+                            "server sent unexpected range for {}."
+                            " restarting".format(uri)
+                            )
+                        resp.close()
+                        part.remove()
+                        redirects += 1
+                        if redirects > MAX_REDIRECTS:
+                            break
+                        continue
+                elif resp.status == 206:
+                    part.open(resume=True)
+                elif resp.status == 200:
+                    if existing_size != 0:
+                        self.logger.warning(
+                            "server can't continue {}."
+                            " downloading from start".format(uri)
+                            )
+                    part.open(resume=False)
+                else:
+                    self.logger.error(
+                        "server responded {} {} for {}".format(
+                            resp.status,
+                            resp.reason,
+                            uri
+                            )
+                        )
+                    break
+
+                expected_size = None
+                if resp.status == 206:
+                    expected_size = content_range[2]
+                else:
+                    content_length = resp.getheader('Content-Length', '')
+                    if content_length.isdigit():
+                        expected_size = int(content_length)
+
+                ret = self._stream(resp.read, part, stop_event)
+
+                if (ret is True
+                        and expected_size is not None
+                        and part.size != expected_size):
+                    self.logger.error(
+                        "incomplete download: {} ({} of {} bytes)".format(
+                            uri,
+                            part.size,
+                            expected_size
+                            )
+                        )
+                    ret = None
+
+            finally:
+                resp.release()
+
+            break
+
+        return ret
+
+    def _download_ftp(self, uri, part, stop_event):
+
+        ret = None
+
+        split = urllib.parse.urlsplit(uri)
+        host = split.hostname
+        port = split.port
+        if port is None:
+            port = 21
+        path = urllib.parse.unquote(split.path)
+
+        ftp = self.ftp_pool.get(host, port)[0]
+
+        reusable = False
+
+        try:
+            ftp.voidcmd('TYPE I')
+
+            total = None
+            try:
+                total = ftp.size(path)
+            except ftplib.error_perm:
+                pass
+
+            existing_size = part.existing_size()
+
+            if total is not None and existing_size == total:
+                part.open(resume=True)
+                ret = True
+                reusable = True
+            else:
+                rest = None
+                if existing_size != 0:
+                    rest = existing_size
+
+                try:
+                    conn = ftp.transfercmd('RETR {}'.format(path), rest=rest)
+                except (
+                        ftplib.error_reply,
+                        ftplib.error_perm,
+                        ftplib.error_temp
+                        ):
+                    # NOTE: servers refusing REST answer with 4xx or 5xx
+                    if rest is None:
+                        raise
+                    self.logger.warning(
+                        "server can't continue {}."
+                        " downloading from start".format(uri)
+                        )
+                    rest = None
+                    conn = ftp.transfercmd('RETR {}'.format(path))
+
+                part.open(resume=rest is not None)
+
+                with conn:
+                    ret = self._stream(conn.recv, part, stop_event)
+
+                if ret is True:
+                    ftp.voidresp()
+                    reusable = True
+
+                    if total is not None and part.size != total:
+                        self.logger.error(
+                            "incomplete download: {} ({} of {} bytes)".format(
+                                uri,
+                                part.size,
+                                total
+                                )
+                            )
+                        ret = None
+
+        finally:
+            if reusable:
+                self.ftp_pool.put(host, port, ftp)
+            else:
+                ftp.close()
+
+        return ret
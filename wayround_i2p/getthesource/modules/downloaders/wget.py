@@ -1,13 +1,22 @@
 
 import threading
-import time
 import subprocess
 
+import wayround_i2p.utils.path
+import wayround_i2p.utils.checksum
+
 import wayround_i2p.getthesource.mirrorer
 
 
 class Wget:
 
+    # NOTE: how often wait() checks external stop_event. process end is
+    #       detected immediately, this only limits stop reaction time
+    STOP_EVENT_CHECK_INTERVAL = 1
+
+    # NOTE: time given to wget to exit after SIGTERM, before it is killed
+    TERMINATE_TIMEOUT = 3
+
     def __init__(
             self,
             downloader,
@@ -16,7 +25,8 @@ class Wget:
             new_basename=None,
             stop_event=None,
             ignore_invalid_connection_security=False,
-            downloader_obfuscation_required=False
+            downloader_obfuscation_required=False,
+            checksum_method=None
             ):
 
         self._downloader = downloader
@@ -28,8 +38,7 @@ class Wget:
         self._logger = self._downloader.logger
 
         self._start_lock = threading.Lock()
-
-        self._internal_started_waiter_flag = threading.Event()
+        self._started = False
 
         self._process_result = None
 
@@ -43,105 +52,137 @@ class Wget:
         self.downloader_obfuscation_required =\
             downloader_obfuscation_required
 
-        return
+        self.checksum_method = checksum_method
 
-    def _stop_flag_watcher(self):
-        while True:
-            if self._own_stop_event.is_set():
-                break
-            if self._stop_event is not None and self._stop_event.is_set():
-                break
-            time.sleep(1)
-
-        threading.Thread(target=self.stop).start()
+        self.checksum = None
 
         return
 
-    def _program_exit_waiter(self):
+    def _output_filename(self):
+        return wayround_i2p.utils.path.join(
+            self.outputdir,
+            self.new_basename
+            )
+
+    def _gen_cmd_line(self):
 
-        output_filename_options = [
-            '-O',
-            wayround_i2p.utils.path.join(
-                self.outputdir,
-                self.new_basename
-                )
-            ]
+        output_filename_options = ['-O', self._output_filename()]
 
         connection_sec_check_options = []
         if self.ignore_invalid_connection_security:
             connection_sec_check_options.append('--no-check-certificate')
 
-        cmd_line = (
+        ret = (
             ['wget'] + ['-c'] +
             output_filename_options +
             connection_sec_check_options +
             [self.uri]
             )
 
-        self._logger.info("wget command is: {}".format(cmd_line))
-
-        try:
-            self._process = subprocess.Popen(
-                cmd_line,
-                stdin=subprocess.DEVNULL,
-                stdout=self._logger.stdout,
-                stderr=self._logger.stderr,
-                # bufsize=0
-                )
-        except:
-            self._logger.exception(
-                "program starting error: {}".format(cmd_line)
-                )
-
-        self._internal_started_waiter_flag.set()
-        ret = self._process.wait()
-        self._logger.info("process exited with code: {}".format(ret))
-        self._process_result = ret
-        threading.Thread(target=self.stop).start()
-        return
+        return ret
 
     def start(self):
         with self._start_lock:
-            if self._process is None:
-                threading.Thread(target=self._program_exit_waiter).start()
-                self._internal_started_waiter_flag.wait()
+            if not self._started:
+                self._started = True
+
+                cmd_line = self._gen_cmd_line()
+
+                self._logger.info("wget command is: {}".format(cmd_line))
+
+                try:
+                    self._process = subprocess.Popen(
+                        cmd_line,
+                        stdin=subprocess.DEVNULL,
+                        stdout=self._logger.stdout,
+                        stderr=self._logger.stderr,
+                        # bufsize=0
+                        )
+                except:
+                    self._logger.exception(
+                        "program starting error: {}".format(cmd_line)
+                        )
 
         return
 
     def _stop(self):
         self._own_stop_event.set()
-        try:
-            self._process.terminate()
-            time.sleep(3)
-        except:
-            self._logger.exception("error")
-
-        # TODO: it is better to know somehow other way, but not using bloody
-        #       kill though
-        try:
-            self._process.kill()
-        except:
-            self._logger.exception("error")
+
+        if self._process is not None and self._process.poll() is None:
+
+            try:
+                self._process.terminate()
+            except:
+                self._logger.exception("error")
+
+            try:
+                self._process.wait(timeout=self.TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._logger.warning(
+                    "wget not exited after SIGTERM. killing it"
+                    )
+                try:
+                    self._process.kill()
+                except:
+                    self._logger.exception("error")
 
         return
 
     def stop(self):
-        # NOTE: _stop() contains waitings based on time, so they must not block
-        #       programm
+        # NOTE: _stop() may wait for process to terminate, so it must not
+        #       block programm
         threading.Thread(target=self._stop).start()
         return
 
     def wait(self):
+        """
+        return: True - ok, None - error, False - stopped before completion
 
-        if self._process is None:
+        if checksum_method was passed, after successful download
+        self.checksum contains file's checksum
+        """
+
+        if not self._started:
             raise Exception("can't wait for end of what is not started yet")
 
-        while True:
+        ret = None
 
-            if self._own_stop_event.is_set():
-                break
+        if self._process is not None:
 
-        return self._process_result
+            timeout = None
+            if self._stop_event is not None:
+                timeout = self.STOP_EVENT_CHECK_INTERVAL
+
+            while True:
+                try:
+                    self._process_result = self._process.wait(timeout=timeout)
+                    break
+                except subprocess.TimeoutExpired:
+                    if (self._stop_event.is_set()
+                            and not self._own_stop_event.is_set()):
+                        self.stop()
+
+            self._logger.info(
+                "process exited with code: {}".format(self._process_result)
+                )
+
+            if self._process_result == 0:
+                ret = True
+            elif self._own_stop_event.is_set():
+                ret = False
+
+        # NOTE: file is hashed only after wget succeeded: `wget -c' can
+        #       truncate and restart file at any moment, so hashing it
+        #       while it's written is not reliable
+        if ret is True and self.checksum_method is not None:
+            checksum = wayround_i2p.utils.checksum.make_file_checksum(
+                self._output_filename(),
+                self.checksum_method
+                )
+            if isinstance(checksum, str):
+                self.checksum = checksum.lower()
+
+        return ret
 
 
 class Downloader:
@@ -160,6 +201,9 @@ class Downloader:
 
         return
 
+    def close(self):
+        return
+
     def get_downloader_name(self):
         return 'GNU/Wget'
 
@@ -179,13 +223,19 @@ class Downloader:
             new_basename=None,
             stop_event=None,
             ignore_invalid_connection_security=False,
-            downloader_obfuscation_required=False
+            downloader_obfuscation_required=False,
+            checksum_method=None,
+            checksum_callback=None
             ):
         """
         return: True - ok, None - error, False - ok, but download not completed
+
+        checksum_method - hashlib algorithm name. if passed, checksum of
+            downloaded file is passed to checksum_callback as lower case hex
+            string after successful download
         """
 
-        ret = True
+        ret = None
 
         proc = Wget(
             self,
@@ -198,9 +248,15 @@ class Downloader:
                 ),
             downloader_obfuscation_required=(
                 downloader_obfuscation_required
-                )
+                ),
+            checksum_method=checksum_method
             )
         proc.start()
         ret = proc.wait()
 
+        if (ret is True
+                and checksum_callback is not None
+                and proc.checksum is not None):
+            checksum_callback(proc.checksum)
+
         return ret
@@ -7,19 +7,17 @@ import os.path
 import logging
 import urllib.request
 import datetime
-import hashlib
 
 import yaml
 import lxml.html
 
 import wayround_i2p.utils.path
-import wayround_i2p.utils.data_cache
 import wayround_i2p.utils.data_cache_miscs
 import wayround_i2p.utils.tarball
-import wayround_i2p.utils.htmlwalk
 
 
 import wayround_i2p.getthesource.uriexplorer
+import wayround_i2p.getthesource.dir_listing
 import wayround_i2p.getthesource.modules.providers.templates.std_https
 
 
@@ -40,6 +38,8 @@ class Provider(
                 )
 
         self.cache_dir = controller.cache_dir
+        self.crawl_store = controller.crawl_store
+        self.http_pool = controller.http_pool
         self.logger = controller.logger
 
         self._inmemory_cache_for_tarballs = None
@@ -75,6 +75,9 @@ class Provider(
     def listdir_timeout(self):
         return datetime.timedelta(days=10)
 
+    def walk_concurrency(self):
+        return 8
+
     def listdir(self, project, path='/', use_cache=True):
         """
         params:
@@ -101,37 +104,42 @@ class Provider(
             return [], {}
 
         if use_cache:
-            digest = hashlib.sha1()
-            digest.update(path.encode('utf-8'))
-            digest = digest.hexdigest().lower()
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(listdir)-({})'.format(
-                    self.get_provider_name(),
-                    digest
-                    ),
-                self.listdir_timeout(),
-                'sha1',
-                self.listdir,
-                freshdata_callback_args=(project, ),
-                freshdata_callback_kwargs=dict(path=path, use_cache=False)
+            ret = self.get_cached_listdir(
+                project,
+                path,
+                self.fetch_listdir,
+                fetch_callback_args=(project, path)
                 )
-            ret = dc.get_data_cache()
         else:
-            self.logger.info("getting listdir at: {}".format(path))
+            ret = self.fetch_listdir(project, path).result
 
-            ret = None, None
+        return ret
 
-            html_walk = wayround_i2p.utils.htmlwalk.HTMLWalk(
-                'download.gnome.org'
-                )
+    def fetch_listdir(self, project, path, etag=None, last_modified=None):
+        """
+        get listing from server. etag and last_modified make request
+        conditional
 
-            path = wayround_i2p.utils.path.join('sources', path)
+        return: dir_listing.ListingFetchResult, which's `result' is
+            listdir() result
+        """
+
+        self.logger.info("getting listdir at: {}".format(path))
+
+        path = wayround_i2p.utils.path.join('sources', path)
 
-            folders, files = html_walk.listdir2(path)
+        ret = wayround_i2p.getthesource.dir_listing.fetch_listing(
+            self.http_pool,
+            'https://download.gnome.org/{}/'.format(path.strip('/')),
+            etag=etag,
+            last_modified=last_modified,
+            logger=self.logger
+            )
+
+        if ret.folders is not None and ret.files is not None:
 
             files_d = {}
-            for i in files:
+            for i in ret.files:
                 new_uri = '{}{}'.format(
                     'https://download.gnome.org/',
                     wayround_i2p.utils.path.join(
@@ -141,9 +149,7 @@ class Provider(
                     )
                 files_d[i] = new_uri
 
-            files = files_d
-
-            ret = folders, files
+            ret.result = ret.folders, files_d
 
         return ret
 
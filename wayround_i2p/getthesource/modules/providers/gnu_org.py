@@ -7,19 +7,17 @@ import os.path
 import logging
 import urllib.request
 import datetime
-import hashlib
 
 import yaml
 import lxml.html
 
 import wayround_i2p.utils.path
-import wayround_i2p.utils.data_cache
 import wayround_i2p.utils.data_cache_miscs
 import wayround_i2p.utils.tarball
-import wayround_i2p.utils.htmlwalk
 
 
 import wayround_i2p.getthesource.uriexplorer
+import wayround_i2p.getthesource.dir_listing
 import wayround_i2p.getthesource.modules.providers.templates.std_https
 
 
@@ -40,6 +38,8 @@ class Provider(
                 )
 
         self.cache_dir = controller.cache_dir
+        self.crawl_store = controller.crawl_store
+        self.http_pool = controller.http_pool
         self.logger = controller.logger
         return
 
@@ -74,21 +74,21 @@ class Provider(
     def get_cache_dir(self):
         return self.cache_dir
 
+    def walk_concurrency(self):
+        return 4
+
     def get_project_names(self, use_cache=True):
         ret = None
 
         if use_cache:
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(project_names)'.format(
-                    self.get_provider_name()
-                    ),
+            ret = self.get_cached_data(
+                'project_names',
+                None,
+                '',
                 datetime.timedelta(days=1),
-                'sha1',
                 self.get_project_names,
                 freshdata_callback_kwargs=dict(use_cache=False)
                 )
-            ret = dc.get_data_cache()
         else:
             page = None
             try:
@@ -152,34 +152,41 @@ class Provider(
         """
 
         if use_cache:
-            digest = hashlib.sha1()
-            digest.update(path.encode('utf-8'))
-            digest = digest.hexdigest().lower()
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(listdir)-({})-({})'.format(
-                    self.get_provider_name(),
-                    project,
-                    digest
-                    ),
-                self.listdir_timeout(),
-                'sha1',
-                self.listdir,
-                freshdata_callback_args=(project,),
-                freshdata_callback_kwargs=dict(path=path, use_cache=False)
+            ret = self.get_cached_listdir(
+                project,
+                path,
+                self.fetch_listdir,
+                fetch_callback_args=(project, path)
                 )
-            ret = dc.get_data_cache()
         else:
+            ret = self.fetch_listdir(project, path).result
 
-            ret = None, None
+        return ret
 
-            html_walk = wayround_i2p.utils.htmlwalk.HTMLWalk('ftp.gnu.org')
+    def fetch_listdir(self, project, path, etag=None, last_modified=None):
+        """
+        get listing from server. etag and last_modified make request
+        conditional
+
+        return: dir_listing.ListingFetchResult, which's `result' is
+            listdir() result
+        """
 
-            path = wayround_i2p.utils.path.join('gnu', project, path)
+        path = wayround_i2p.utils.path.join('gnu', project, path)
 
-            folders, files = html_walk.listdir2(path)
+        ret = wayround_i2p.getthesource.dir_listing.fetch_listing(
+            self.http_pool,
+            'https://ftp.gnu.org/{}/'.format(path.strip('/')),
+            etag=etag,
+            last_modified=last_modified,
+            logger=self.logger
+            )
+
+        if not ret.not_modified:
+
+            folders, files = ret.folders, ret.files
             if folders is None or files is None:
-                folders, files = [], {}
+                folders, files = [], []
 
             files_d = {}
             for i in files:
@@ -192,13 +199,6 @@ class Provider(
                         )
                     )
 
-                #print("files_d[i] : {}".format(files_d[i]))
-                #print("project : {}".format(project))
-                #print("path : {}".format(path))
-                #print("i : {}".format(i))
-
-            files = files_d
-
-            ret = folders, files
+            ret.result = folders, files_d
 
         return ret
@@ -7,14 +7,12 @@ import os.path
 import logging
 import urllib.request
 import datetime
-import hashlib
 import fnmatch
 
 import yaml
 import lxml.html
 
 import wayround_i2p.utils.path
-import wayround_i2p.utils.data_cache
 import wayround_i2p.utils.data_cache_miscs
 import wayround_i2p.utils.tarball
 import wayround_i2p.utils.htmlwalk
@@ -41,6 +39,7 @@ class Provider(
                 )
 
         self.cache_dir = controller.cache_dir
+        self.crawl_store = controller.crawl_store
         self.logger = controller.logger
         return
 
@@ -98,23 +97,15 @@ class Provider(
         """
 
         if use_cache:
-            digest = hashlib.sha1()
-            digest.update(path.encode('utf-8'))
-            digest = digest.hexdigest().lower()
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(sf.net)-(listdir)-({})-({})'.format(
-                    self.get_provider_name(),
-                    project,
-                    digest
-                    ),
+            ret = self.get_cached_data(
+                'listdir',
+                project,
+                path,
                 self.listdir_timeout(),
-                'sha1',
                 self.listdir,
                 freshdata_callback_args=(project,),
                 freshdata_callback_kwargs=dict(path=path, use_cache=False)
                 )
-            ret = dc.get_data_cache()
         else:
 
             self.logger.info("searching in: {}".format(path))
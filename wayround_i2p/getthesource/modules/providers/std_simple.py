@@ -1,17 +1,82 @@
 
 import os.path
-import fnmatch
-import hashlib
-import regex
-import ftplib
+import urllib.parse
 
 import wayround_i2p.utils.path
-import wayround_i2p.utils.htmlwalk
-import wayround_i2p.utils.ftpwalk
+import wayround_i2p.utils.uri
 
+import wayround_i2p.getthesource.dir_listing
+import wayround_i2p.getthesource.ftp_listing
+import wayround_i2p.getthesource.path_filter
 import wayround_i2p.getthesource.modules.providers.templates.std_https
 
 
+class SimpleCrawlContext:
+    """
+    Everything listdir() needs, prepared once from simple_config: parsed
+    target uri, compiled exclusion and rejection rules and connection
+    pools
+    """
+
+    def __init__(self, simple_config, http_pool, ftp_pool):
+
+        if simple_config is None:
+            simple_config = {}
+
+        self.http_pool = http_pool
+        self.ftp_pool = ftp_pool
+
+        self.target_uri = simple_config.get('target_uri', None)
+
+        self.scheme = None
+        self.host = None
+        self.port = None
+        self.target_uri_path = None
+        self.target_uri_with_root_path = None
+
+        if self.target_uri is not None:
+            uri_obj = wayround_i2p.utils.uri.HttpURI.new_from_string(
+                self.target_uri
+                )
+            self.scheme = uri_obj.scheme
+            self.host = uri_obj.authority.host
+            self.port = urllib.parse.urlsplit(self.target_uri).port
+            if self.port is None and self.scheme == 'ftp':
+                self.port = 21
+            self.target_uri_path = uri_obj.path
+
+            uri_obj_copy = uri_obj.copy()
+            uri_obj_copy.path = None
+            self.target_uri_with_root_path = str(uri_obj_copy)
+
+        self.exclude_paths_matcher = (
+            wayround_i2p.getthesource.path_filter.PathMatcher(
+                simple_config.get('exclude_paths', []),
+                simple_config.get('exclude_paths_re', [])
+                )
+            )
+        self.exclude_paths_bases_matcher = (
+            wayround_i2p.getthesource.path_filter.PathMatcher(
+                simple_config.get('exclude_paths_bases', []),
+                simple_config.get('exclude_paths_bases_re', [])
+                )
+            )
+        self.reject_files_matcher = (
+            wayround_i2p.getthesource.path_filter.PathMatcher(
+                simple_config.get('reject_files', []),
+                simple_config.get('reject_files_re', [])
+                )
+            )
+
+        return
+
+    def is_path_excluded(self, path):
+        return (
+            self.exclude_paths_matcher.match(path)
+            or self.exclude_paths_bases_matcher.match(os.path.basename(path))
+            )
+
+
 class Provider(
         wayround_i2p.getthesource.modules.providers.templates.std_https.
         StandardHttps
@@ -28,12 +93,20 @@ class Provider(
                 )
 
         self.cache_dir = controller.cache_dir
+        self.crawl_store = controller.crawl_store
+        self.http_pool = controller.http_pool
         self.logger = controller.logger
 
         self._inmemory_cache_for_tarballs = None
 
         self.simple_config = controller.simple_config
-        self.ftp_client = None
+
+        self.crawl_context = SimpleCrawlContext(
+            self.simple_config,
+            self.http_pool,
+            controller.ftp_pool
+            )
+
         return
 
     def get_provider_name(self):
@@ -60,6 +133,21 @@ class Provider(
     def get_cs_method_name(self):
         return 'sha1'
 
+    def crawl_store_namespace(self):
+        # NOTE: results for different target uris must not be mixed
+        return '{} ({})'.format(
+            self.get_provider_name(),
+            self.crawl_context.target_uri
+            )
+
+    def walk_concurrency(self):
+        # NOTE: both http and ftp listings are done with pooled
+        #       connections, one per thread
+        return 4
+
+    def walk_host(self):
+        return self.crawl_context.host
+
     def listdir(self, project, path='/', use_cache=True):
         """
         params:
@@ -78,173 +166,94 @@ class Provider(
                 "`project' for `std_simple' provider must always be None"
                 )
 
-        #'''
-        exclude_paths = self.simple_config.get('exclude_paths', [])
-        exclude_paths_re = self.simple_config.get('exclude_paths_re', [])
-        exclude_paths_bases = self.simple_config.get('exclude_paths_bases', [])
-        exclude_paths_bases_re = (
-            self.simple_config.get('exclude_paths_bases_re', [])
-            )
-        reject_files = self.simple_config.get('reject_files', [])
-        reject_files_re = self.simple_config.get('reject_files_re', [])
-        #'''
-
-        target_uri = self.simple_config.get('target_uri', None)
-
-        uri_obj = wayround_i2p.utils.uri.HttpURI.new_from_string(target_uri)
-        uri_obj_copy = uri_obj.copy()
-        uri_obj_copy.path = None
-        target_uri_with_root_path = str(uri_obj_copy)
-        target_uri_path = uri_obj.path
-
-        del uri_obj_copy
+        ctx = self.crawl_context
 
-        if uri_obj.scheme not in ['http', 'https', 'ftp']:
+        if ctx.scheme not in ['http', 'https', 'ftp']:
             raise ValueError(
-                "Invalid URI scheme: not supported: {}".format(uri_obj.scheme)
+                "Invalid URI scheme: not supported: {}".format(ctx.scheme)
                 )
 
-        #'''
-        for i in exclude_paths:
-            if fnmatch.fnmatch(path, i):
-                return [], {}
-
-        for i in exclude_paths_bases:
-            if fnmatch.fnmatch(os.path.basename(path), i):
-                return [], {}
-
-        for i in exclude_paths_re:
-            if regex.match(i, path):
-                return [], {}
-
-        for i in exclude_paths_bases_re:
-            if regex.match(i, os.path.basename(path)):
-                return [], {}
-        #'''
+        if ctx.is_path_excluded(path):
+            return [], {}
 
         if use_cache:
-            digest = hashlib.sha1()
-            digest.update(
+            ret = self.get_cached_listdir(
+                project,
                 wayround_i2p.utils.path.join(
-                    uri_obj.path,
+                    ctx.target_uri_path,
                     path
-                    ).encode('utf-8')
-                )
-            digest = digest.hexdigest().lower()
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(for {})-(listdir)-({})'.format(
-                    self.get_provider_name(),
-                    uri_obj.authority.host,
-                    digest
                     ),
-                self.listdir_timeout(),
-                'sha1',
-                self.listdir,
-                freshdata_callback_args=(project, ),
-                freshdata_callback_kwargs=dict(path=path, use_cache=False)
+                self.fetch_listdir,
+                fetch_callback_args=(project, path)
                 )
-            ret = dc.get_data_cache()
         else:
-            self.logger.info("getting listdir at: {}".format(path))
-
-            ret = None, None
+            ret = self.fetch_listdir(project, path).result
 
-            walker_obj = None
-            walker_obj_listdir_method = None
+        if ret[0] is not None and not ctx.reject_files_matcher.is_empty():
 
-            if uri_obj.scheme in ['http', 'https']:
-
-                walker_obj = wayround_i2p.utils.htmlwalk.HTMLWalk(
-                    uri_obj.authority.host,
-                    scheme=uri_obj.scheme,
-                    port=uri_obj.authority.port
-                    )
-                walker_obj_listdir_method = walker_obj.listdir2
-
-            elif uri_obj.scheme in ['ftp']:
-                if self.ftp_client is None:
-                    self.ftp_prefix_uri = 'ftp://{}'.format(
-                        uri_obj.authority.host
-                        )
-                    self.ftp_client = ftplib.FTP(
-                        uri_obj.authority.host,
-                        user='anonymous'
-                        )
-                    self.ftp_walk = wayround_i2p.utils.ftpwalk.FTPWalk(
-                        self.ftp_client
-                        )
-                walker_obj = self.ftp_client
-                walker_obj_listdir_method = self.ftp_listdir
-
-            else:
-                raise Exception("programming error")
-
-            path = wayround_i2p.utils.path.join('/', uri_obj.path, path)
-
-            #print("getting list for: {}".format(path))
-            folders, files = walker_obj_listdir_method(path)
-            #print("    result: {}".format((folders, files)))
-
-            if folders is not None and files is not None:
-
-                files_d = {}
-                for i in files:
-                    new_uri = '{}{}'.format(
-                        target_uri_with_root_path,
-                        wayround_i2p.utils.path.join(path, i).lstrip('/')
-                        )
-                    files_d[i] = new_uri
+            files = ret[1]
 
-                files = files_d
+            for i in list(files.keys()):
+                if ctx.reject_files_matcher.match(i):
+                    del files[i]
 
-                ret = folders, files
+            ret = ret[0], files
 
-        #'''
-        if ret[0] is not None:
+        return ret
 
-            files = ret[1]
+    def fetch_listdir(self, project, path, etag=None, last_modified=None):
+        """
+        get listing from server. etag and last_modified make request
+        conditional (for http and https only)
 
-            for i in list(files.keys()):
-                for j in reject_files:
-                    if fnmatch.fnmatch(i, j):
-                        if i in files:
-                            del files[i]
+        return: dir_listing.ListingFetchResult, which's `result' is
+            listdir() result
+        """
 
-            for i in list(files.keys()):
-                for j in reject_files_re:
-                    if regex.match(j, i):
-                        if i in files:
-                            del files[i]
+        self.logger.info("getting listdir at: {}".format(path))
 
-            ret = ret[0], files
-        #'''
+        ctx = self.crawl_context
 
-        return ret
+        path = wayround_i2p.utils.path.join('/', ctx.target_uri_path, path)
 
-    def ftp_listdir(self, path):
-        ret = None, None
+        if ctx.scheme in ['http', 'https']:
 
-        lst = self.ftp_walk.listdir(path)
+            ret = wayround_i2p.getthesource.dir_listing.fetch_listing(
+                ctx.http_pool,
+                '{}{}/'.format(
+                    ctx.target_uri_with_root_path,
+                    path.strip('/')
+                    ),
+                etag=etag,
+                last_modified=last_modified,
+                logger=self.logger
+                )
 
-        if isinstance(lst, list):
+        elif ctx.scheme in ['ftp']:
 
-            dirs = []
-            files = {}
+            ret = wayround_i2p.getthesource.ftp_listing.fetch_listing(
+                ctx.ftp_pool,
+                ctx.host,
+                ctx.port,
+                path,
+                logger=self.logger
+                )
 
-            for i in lst:
+        else:
+            raise Exception("programming error")
 
-                if i in ['..', '.', '/']:
-                    continue
+        if ret.folders is not None and ret.files is not None:
 
-                ij = wayround_i2p.utils.path.join(path, i)
+            files_d = {}
+            for i in ret.files:
+                new_uri = '{}{}'.format(
+                    ctx.target_uri_with_root_path,
+                    wayround_i2p.utils.path.join(path, i).lstrip('/')
+                    )
+                files_d[i] = new_uri
 
-                if not self.ftp_walk.is_dir(ij):
-                    files[i] = '{}{}'.format(self.ftp_prefix_uri, ij)
-                else:
-                    dirs.append(i)
+            ret.result = ret.folders, files_d
 
-            ret = dirs, files
         return ret
 
     # FIXME: such mesures shuld not be used
@@ -1,14 +1,75 @@
 
+import time
 import datetime
 import os.path
+import posixpath
 import logging
+import threading
+import urllib.parse
+import concurrent.futures
 
-import wayround_i2p.utils.data_cache
+import wayround_i2p.utils.path
 import wayround_i2p.utils.tarball
 
 
+class _HostLimiter:
+    """
+    Semaphore like limiter, which's limit can be lowered while it's used
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._cond = threading.Condition()
+        return
+
+    def lower_limit(self, limit):
+        with self._cond:
+            if limit < self.limit:
+                self.limit = limit
+        return
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+        return
+
+
+_HOST_LIMITERS = {}
+_HOST_LIMITERS_LOCK = threading.Lock()
+
+
+def get_host_semaphore(host, limit):
+    """
+    Limiter of simultaneous requests to named host (use it in `with'
+    statement).
+
+    Limiters are shared by all providers in process, so two providers
+    crawling same host can't exceed limit together. Smallest limit passed
+    for host is used.
+    """
+    with _HOST_LIMITERS_LOCK:
+        if host not in _HOST_LIMITERS:
+            _HOST_LIMITERS[host] = _HostLimiter(limit)
+        ret = _HOST_LIMITERS[host]
+    ret.lower_limit(limit)
+    return ret
+
+
 class StandardHttps:
 
+    # NOTE: dict while tree() does incremental refresh, None otherwise.
+    #       see get_cached_listdir()
+    _incremental_refresh_state = None
+
     def check_project_param_value(self, value):
         if self.get_project_param_used() is False:
             if value is not None:
@@ -18,6 +79,157 @@ class StandardHttps:
     def get_cache_dir(self):
         return self.cache_dir
 
+    def crawl_store_namespace(self):
+        """
+        name under which provider's data is kept in crawl store
+        """
+        return self.get_provider_name()
+
+    def get_cached_data(
+            self,
+            kind,
+            project,
+            key,
+            timeout,
+            freshdata_callback,
+            freshdata_callback_args=None,
+            freshdata_callback_kwargs=None
+            ):
+        """
+        shortcut to controller's CrawlStore.get_data_cache()
+        """
+        return self.crawl_store.get_data_cache(
+            self.crawl_store_namespace(),
+            kind,
+            project,
+            key,
+            timeout,
+            freshdata_callback,
+            freshdata_callback_args=freshdata_callback_args,
+            freshdata_callback_kwargs=freshdata_callback_kwargs
+            )
+
+    def get_cached_listdir(
+            self,
+            project,
+            key,
+            fetch_callback,
+            fetch_callback_args=None
+            ):
+        """
+        listdir() result from crawl store.
+
+        expired listing is revalidated: fetch_callback is called with
+        ETag and Last-Modified values saved with listing, and if it reports
+        listing is not modified, saved listing is only renewed.
+
+        while tree() does incremental refresh, expired listing is not
+        requested at all, if parent listing is got from server in this
+        refresh and it's row for this directory (modification time, size)
+        is same as when this listing was got last time.
+
+        fetch_callback(*fetch_callback_args, etag=..., last_modified=...)
+            must return dir_listing.ListingFetchResult
+        """
+
+        if fetch_callback_args is None:
+            fetch_callback_args = ()
+
+        namespace = self.crawl_store_namespace()
+
+        state = self._incremental_refresh_state
+
+        parent_stat = None
+        if state is not None:
+            key_stripped = key.rstrip('/')
+            parent_stats = state['current'].get(
+                (project, posixpath.dirname(key_stripped).rstrip('/'))
+                )
+            if parent_stats is not None and key_stripped != '':
+                # NOTE: empty row (index page without modification time
+                #       and size columns) tells nothing about changes
+                parent_stat = parent_stats.get(
+                    posixpath.basename(key_stripped),
+                    None
+                    ) or None
+
+        rec = self.crawl_store.get(namespace, 'listdir', project, key)
+
+        if rec is not None and rec[1] > time.time():
+            ret = rec[0]
+
+        elif (rec is not None
+                and parent_stat
+                and rec[2].get('parent_stat', None) == parent_stat):
+            self.crawl_store.touch(
+                namespace,
+                'listdir',
+                project,
+                key,
+                self.listdir_timeout()
+                )
+            ret = rec[0]
+            with state['lock']:
+                state['unchanged'] += 1
+
+        else:
+
+            etag = None
+            last_modified = None
+
+            if rec is not None:
+                etag = rec[2].get('etag', None)
+                last_modified = rec[2].get('last_modified', None)
+
+            res = fetch_callback(
+                *fetch_callback_args,
+                etag=etag,
+                last_modified=last_modified
+                )
+
+            stats = None
+
+            if res.not_modified and rec is not None:
+                self.crawl_store.touch(
+                    namespace,
+                    'listdir',
+                    project,
+                    key,
+                    self.listdir_timeout()
+                    )
+                ret = rec[0]
+                stats = rec[2].get('stats', None)
+            else:
+                ret = res.result
+                meta = {}
+                if ret[0] is not None:
+                    stats = res.stats
+                    meta = {
+                        'etag': res.etag,
+                        'last_modified': res.last_modified,
+                        'stats': stats,
+                        'parent_stat': parent_stat
+                        }
+                self.crawl_store.set(
+                    namespace,
+                    'listdir',
+                    project,
+                    key,
+                    ret,
+                    self.listdir_timeout(),
+                    meta=meta
+                    )
+
+            if state is not None:
+                with state['lock']:
+                    state['requested'] += 1
+                    if stats is not None:
+                        # NOTE: listing is got from server just now, so
+                        #       it's rows are trustworthy for children
+                        state['current'][(project, key.rstrip('/'))] = stats
+
+        return ret
+
     def listdir_timeout(self):
         return datetime.timedelta(days=1)
 
@@ -30,13 +242,42 @@ class StandardHttps:
     def basenames_timeout(self):
         return datetime.timedelta(days=1)
 
-    def walk(self, project, path='/'):
+    def walk_concurrency(self):
+        """
+        Count of listdir() calls which walk() is allowed to run at once.
 
-        if self.get_project_param_used() is False:
-            if project is not None:
-                raise ValueError("`project' param nust be None")
+        1 means plain sequential depth-first walk. Providers which's
+        listdir() is thread safe may return greater value.
+        """
+        return 1
 
-        folders, files = self.listdir(project, path=path)
+    def walk_host_concurrency(self):
+        """
+        Maximum simultaneous listdir() calls to walk_host()
+        """
+        return 4
+
+    def walk_host(self):
+        """
+        Host name used for concurrency limiting. None - no host limit
+        """
+        ret = None
+        uri = self.get_provider_main_downloads_uri()
+        if uri is not None:
+            ret = urllib.parse.urlsplit(uri).hostname
+        return ret
+
+    def _walk_listdir(self, project, path):
+
+        folders, files = None, None
+
+        host = self.walk_host()
+
+        if host is None:
+            folders, files = self.listdir(project, path=path)
+        else:
+            with get_host_semaphore(host, self.walk_host_concurrency()):
+                folders, files = self.listdir(project, path=path)
 
         if folders is None and files is None:
             #raise Exception("listdir() func returned error")
@@ -51,46 +292,169 @@ class StandardHttps:
 
         folders.sort()
 
+        return folders, files
+
+    def walk(self, project, path='/'):
+        """
+        yields (path, folders, files) tuples, parents before children,
+        folders in sorted order. walk_concurrency() decides whatever
+        listdir() calls are done sequentially or on thread pool; order of
+        yielded tuples is same in both cases
+        """
+
+        self.check_project_param_value(project)
+
+        if self.walk_concurrency() > 1:
+            gen = self._walk_concurrent(project, path)
+        else:
+            gen = self._walk_sequential(project, path)
+
+        for i in gen:
+            yield i
+
+        return
+
+    def _walk_sequential(self, project, path):
+
+        folders, files = self._walk_listdir(project, path)
+
         yield path, folders, files
 
         for i in folders:
             jo = wayround_i2p.utils.path.join(path, i)
-            for j in self.walk(project, jo):
+            for j in self._walk_sequential(project, jo):
                 yield j
 
         return
 
-    def tree(self, project, use_cache=True):
+    def _walk_concurrent(self, project, path):
+        """
+        listdir() is submitted to pool for next folders to be yielded
+        (at most 2 * pool size of them ahead), and results are yielded in
+        same depth-first order as _walk_sequential() does
+        """
+
+        max_workers = self.walk_concurrency()
+
+        # NOTE: threads above host limit would only wait for it
+        if self.walk_host() is not None:
+            max_workers = min(max_workers, self.walk_host_concurrency())
+
+        lookahead = max_workers * 2
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+            )
+
+        try:
+            # NOTE: [path, future or None]. top of stack is yielded next
+            stack = [[path, None]]
+
+            # NOTE: count of submitted, but not yet yielded listdir()s
+            pending = 0
+
+            while len(stack) != 0:
+
+                for i in stack[-1:-lookahead - 1:-1]:
+                    if pending >= lookahead:
+                        break
+                    if i[1] is None:
+                        i[1] = executor.submit(
+                            self._walk_listdir,
+                            project,
+                            i[0]
+                            )
+                        pending += 1
+
+                path, future = stack.pop()
+
+                if future is None:
+                    future = executor.submit(
+                        self._walk_listdir,
+                        project,
+                        path
+                        )
+                else:
+                    pending -= 1
+
+                folders, files = future.result()
+
+                yield path, folders, files
+
+                stack.extend(
+                    [
+                        [wayround_i2p.utils.path.join(path, i), None]
+                        for i in reversed(folders)
+                        ]
+                    )
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return
+
+    def tree_incremental_refresh(self):
+        """
+        whatever tree(use_cache=False) should skip requesting listings of
+        directories, which are known to be unchanged. see
+        get_cached_listdir()
+        """
+        return True
+
+    def tree(self, project, use_cache=True, incremental=None):
         """
         result: dict, where keys ar full pathnames relatively
             to project root dir (
             but each line is started with slash!
             )
+
+        incremental - None - use tree_incremental_refresh() value
         """
 
         self.check_project_param_value(project)
 
         if use_cache:
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.cache_dir,
-                '({})-(tree)-({})'.format(
-                    self.get_provider_name(),
-                    project
-                    ),
-                datetime.timedelta(days=1),
-                'sha1',
+            ret = self.get_cached_data(
+                'tree',
+                project,
+                '',
+                self.tree_timeout(),
                 self.tree,
                 freshdata_callback_args=(project,),
                 freshdata_callback_kwargs=dict(use_cache=False)
                 )
-            ret = dc.get_data_cache()
         else:
 
+            if incremental is None:
+                incremental = self.tree_incremental_refresh()
+
+            if incremental:
+                self._incremental_refresh_state = {
+                    'lock': threading.Lock(),
+                    'current': {},
+                    'requested': 0,
+                    'unchanged': 0
+                    }
+
             all_files = {}
 
-            for path, dirs, files in self.walk(project):
-                for i in files:
-                    all_files[wayround_i2p.utils.path.join(path, i)] = files[i]
+            try:
+                for path, dirs, files in self.walk(project):
+                    for i in files:
+                        all_files[
+                            wayround_i2p.utils.path.join(path, i)
+                            ] = files[i]
+
+                if incremental:
+                    self.logger.info(
+                        "tree refreshed: {} listing(s) requested,"
+                        " {} known to be unchanged".format(
+                            self._incremental_refresh_state['requested'],
+                            self._incremental_refresh_state['unchanged']
+                            )
+                        )
+            finally:
+                self._incremental_refresh_state = None
 
             ret = all_files
 
@@ -101,19 +465,15 @@ class StandardHttps:
         self.check_project_param_value(project)
 
         if use_cache:
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.get_cache_dir(),
-                '({})-(tarballs)-({})'.format(
-                    self.get_provider_name(),
-                    project
-                    ),
+            ret = self.get_cached_data(
+                'tarballs',
+                project,
+                '',
                 self.tarballs_timeout(),
-                self.get_cs_method_name(),
                 self.tarballs,
                 freshdata_callback_args=(project, ),
                 freshdata_callback_kwargs=dict(use_cache=False)
                 )
-            ret = dc.get_data_cache()
         else:
             tree = self.tree(project, use_cache=use_tree_cache)
 
@@ -141,33 +501,49 @@ class StandardHttps:
         self.check_project_param_value(project)
 
         if use_cache:
-            dc = wayround_i2p.utils.data_cache.ShortCSTimeoutYamlCacheHandler(
-                self.get_cache_dir(),
-                '({})-(basenames)-({})'.format(
-                    self.get_provider_name(),
-                    project
-
-                    ),
+            ret = self.get_cached_data(
+                'basenames',
+                project,
+                '',
                 self.basenames_timeout(),
-                self.get_cs_method_name(),
                 self.basenames,
                 freshdata_callback_args=(project,),
                 freshdata_callback_kwargs=dict(use_cache=False)
                 )
-            ret = dc.get_data_cache()
         else:
-            tarballs = self.tarballs(project, use_cache=use_tarballs_cache)
+            ret = list(
+                self.tarballs_by_basename(
+                    project,
+                    use_tarballs_cache=use_tarballs_cache
+                    ).keys()
+                )
 
-            lst = set()
+        return ret
 
-            for i in tarballs:
-                parse_result = wayround_i2p.utils.tarball.parse_tarball_name(
-                    os.path.basename(i[0]),
-                    mute=True
-                    )
-                if parse_result is not None:
-                    lst.add(parse_result['groups']['name'])
+    def tarballs_by_basename(self, project, use_tarballs_cache=True):
+        """
+        result: dict, where keys are tarball basenames and values are lists
+            of tarballs() items with such basename
 
-            ret = list(lst)
+        every tarball name is parsed only once, so this should be used
+        instead of filtering tarballs() result for each basename
+        """
+
+        self.check_project_param_value(project)
+
+        tarballs = self.tarballs(project, use_cache=use_tarballs_cache)
+
+        ret = {}
+
+        for i in tarballs:
+            parse_result = wayround_i2p.utils.tarball.parse_tarball_name(
+                os.path.basename(i[0]),
+                mute=True
+                )
+            if parse_result is not None:
+                name = parse_result['groups']['name']
+                if name not in ret:
+                    ret[name] = []
+                ret[name].append(i)
 
         return ret
@@ -4,12 +4,22 @@ import sys
 import subprocess
 import logging
 import re
+import datetime
 import urllib.request
+import concurrent.futures
 
 import lxml.html
 
+import wayround_i2p.getthesource.crawl_store
+
 OPENJDK_HG_URI = 'http://hg.openjdk.java.net/'
 
+# parsed tags pages are kept in crawl store for this time
+TAGS_PAGE_TIMEOUT = datetime.timedelta(hours=12)
+
+# count of subpackages processed simultaneously
+JOBS = 4
+
 if __name__ == '__main__':
 
     for i in ['', '.']:
@@ -107,6 +117,11 @@ def download_tarball(
         output_filename,
         preferred_extension='bz2'
         ):
+    """
+    ret: 0 - ok, 1 - tarball link not found, other - wget exit code
+    """
+
+    ret = 1
 
     page_text = None
     with urllib.request.urlopen(tarball_page_uri) as f:
@@ -130,28 +145,34 @@ def download_tarball(
 
         os.makedirs(os.path.dirname(output_filename), exist_ok=True)
 
+        # NOTE: -nv, as several downloads are done at once
         p = subprocess.Popen(
             [
                 'wget',
                 '-c',
+                '-nv',
                 '-O',
                 output_filename,
                 tarball_uri
                 ]
             )
 
-        p.wait()
+        ret = p.wait()
 
-    return
+    return ret
 
 
-def get_tag_rev_uri(project_name, package_name, subpackage_name, tag):
+def get_crawl_store(working_dir):
+    return wayround_i2p.getthesource.crawl_store.CrawlStore(
+        os.path.join(working_dir, 'wrogts-cache', 'crawl.sqlite')
+        )
 
-    ret = None
 
-    t_path = tags_path(project_name, package_name, subpackage_name)
-    print("t_path: {}".format(t_path))
-    tags_page_uri = OPENJDK_HG_URI + t_path.lstrip('/')
+def _fetch_tags_page(tags_page_uri):
+    """
+    return: dict, where keys are link texts (tag names) and values are
+        their hrefs
+    """
 
     page_text = None
     print("tags_page_uri: {}".format(tags_page_uri))
@@ -164,52 +185,91 @@ def get_tag_rev_uri(project_name, package_name, subpackage_name, tag):
 
     print("found hrefs: {}".format(len(all_hrefs)))
 
+    ret = {}
+
     for i in all_hrefs:
-        # print("i.text: {}\n\n".format(i.text))
-        if i.text is not None and i.text.strip() == tag:
-            ret = i.get('href', None)
-            break
+        href = i.get('href', None)
+        if i.text is not None and href is not None:
+            ret.setdefault(i.text.strip(), href)
 
-    if isinstance(ret, str):
-        ret = OPENJDK_HG_URI + ret.lstrip('/')
+    return ret
+
+
+def get_tags_page(tags_page_uri, crawl_store=None):
+    """
+    get tags of tags page. if crawl_store passed, parsed page is taken
+    from it, until TAGS_PAGE_TIMEOUT expires
+
+    return: see _fetch_tags_page()
+    """
+
+    if crawl_store is None:
+        ret = _fetch_tags_page(tags_page_uri)
+    else:
+        ret = crawl_store.get_data_cache(
+            'openjdk',
+            'tags_page',
+            None,
+            tags_page_uri,
+            TAGS_PAGE_TIMEOUT,
+            _fetch_tags_page,
+            freshdata_callback_args=(tags_page_uri,)
+            )
 
     return ret
 
 
-def get_tag_rev_uri_jfx(primary_version, subpackage_name, tag):
+def _get_tag_rev_uri_by_path(t_path, tag, crawl_store):
 
     ret = None
 
-    t_path = tags_path_jfx(primary_version, subpackage_name)
-    
     print("t_path: {}".format(t_path))
-    
+
     tags_page_uri = OPENJDK_HG_URI + t_path.lstrip('/')
 
-    page_text = None
-    print("tags_page_uri: {}".format(tags_page_uri))
-    with urllib.request.urlopen(tags_page_uri) as f:
-        page_text = f.read()
+    ret = get_tags_page(tags_page_uri, crawl_store).get(tag, None)
 
-    page_text = lxml.html.document_fromstring(page_text)
+    if isinstance(ret, str):
+        ret = OPENJDK_HG_URI + ret.lstrip('/')
 
-    all_hrefs = page_text.findall('.//a')
+    return ret
 
-    print("found hrefs: {}".format(len(all_hrefs)))
 
-    for i in all_hrefs:
-        # print("i.text: {}\n\n".format(i.text))
-        if i.text is not None and i.text.strip() == tag:
-            ret = i.get('href', None)
-            break
+def get_tag_rev_uri(
+        project_name,
+        package_name,
+        subpackage_name,
+        tag,
+        crawl_store=None
+        ):
+    return _get_tag_rev_uri_by_path(
+        tags_path(project_name, package_name, subpackage_name),
+        tag,
+        crawl_store
+        )
 
-    if isinstance(ret, str):
-        ret = OPENJDK_HG_URI + ret.lstrip('/')
 
-    return ret
+def get_tag_rev_uri_jfx(
+        primary_version,
+        subpackage_name,
+        tag,
+        crawl_store=None
+        ):
+    return _get_tag_rev_uri_by_path(
+        tags_path_jfx(primary_version, subpackage_name),
+        tag,
+        crawl_store
+        )
+
+
+def jdk_routine(requested_tag, working_dir, jobs=JOBS):
+    """
+    tag resolution and downloading of all subpackages are done
+    simultaneously by `jobs' threads
 
+    ret: 0 - ok, 2 - invalid tag, 3 - some subpackages not downloaded
+    """
 
-def jdk_routine(requested_tag):
     ret = 0
 
     re_res = re.match(
@@ -240,7 +300,16 @@ def jdk_routine(requested_tag):
 
         package_name = project_name
 
-        for i in sub_proj_list:
+        ver_str = render_version(
+            ver_main,
+            ver_update,
+            ver_build
+            )
+        print('ver_str: {}'.format(ver_str))
+
+        crawl_store = get_crawl_store(working_dir)
+
+        def subpackage_job(i):
             get_tag_rev_uri_args = (
                 project_name,
                 package_name,
@@ -248,7 +317,10 @@ def jdk_routine(requested_tag):
                 requested_tag
                 )
             print("get_tag_rev_uri args: {}".format(get_tag_rev_uri_args))
-            tag_rev_uri = get_tag_rev_uri(*get_tag_rev_uri_args)
+            tag_rev_uri = get_tag_rev_uri(
+                *get_tag_rev_uri_args,
+                crawl_store=crawl_store
+                )
             print("  tag_rev_uri: {}".format(tag_rev_uri))
             tarball_prefix_name = gen_tarball_prefix_name(
                 i,
@@ -257,28 +329,60 @@ def jdk_routine(requested_tag):
                 ver_build
                 )
             print('tarball_prefix_name: {}'.format(tarball_prefix_name))
-            ver_str = render_version(
-                ver_main,
-                ver_update,
-                ver_build
-                )
-            print('ver_str: {}'.format(ver_str))
-            download_tarball(
-                tag_rev_uri,
-                os.path.join(
-                    PPWD,
-                    'downloads',
-                    project_name,
-                    'jdk-{}'.format(ver_str),
-                    tarball_prefix_name + '.tar.bz2'
-                    ),
-                'bz2'
-                )
-            print()
+
+            if tag_rev_uri is None:
+                logging.error(
+                    "tag {} not found for {}".format(requested_tag, i)
+                    )
+                res = 1
+            else:
+                res = download_tarball(
+                    tag_rev_uri,
+                    os.path.join(
+                        working_dir,
+                        'downloads',
+                        project_name,
+                        'jdk-{}'.format(ver_str),
+                        tarball_prefix_name + '.tar.bz2'
+                        ),
+                    'bz2'
+                    )
+            return res
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=jobs
+                    ) as executor:
+                futures = [
+                    executor.submit(subpackage_job, i)
+                    for i in sub_proj_list
+                    ]
+
+            for i, future in zip(sub_proj_list, futures):
+                try:
+                    res = future.result()
+                except:
+                    logging.exception(
+                        "error getting subpackage {}".format(i)
+                        )
+                    res = 1
+                if res != 0:
+                    ret = 3
+        finally:
+            crawl_store.close()
+
     return ret
 
 
 def jfx_routine(requested_tag, working_dir):
+    """
+    openjfx is single `rt' repository, so there is only one tag to resolve
+    and one tarball to download, and nothing to run in parallel (unlike
+    jdk_routine())
+
+    ret: 0 - ok, 2 - invalid tag, 3 - tarball not downloaded
+    """
+
     ret = 0
 
     re_res = re.match(
@@ -302,12 +406,19 @@ def jfx_routine(requested_tag, working_dir):
     if ret == 0:
 
         get_tag_rev_uri_args = (
-            int(ver_main), 
-            'rt', 
+            int(ver_main),
+            'rt',
             requested_tag
             )
         print("get_tag_rev_uri args: {}".format(get_tag_rev_uri_args))
-        tag_rev_uri = get_tag_rev_uri_jfx(*get_tag_rev_uri_args)
+        crawl_store = get_crawl_store(working_dir)
+        try:
+            tag_rev_uri = get_tag_rev_uri_jfx(
+                *get_tag_rev_uri_args,
+                crawl_store=crawl_store
+                )
+        finally:
+            crawl_store.close()
         print("  tag_rev_uri: {}".format(tag_rev_uri))
         tarball_prefix_name = gen_tarball_prefix_name_jfx(
             ver_main,
@@ -321,16 +432,20 @@ def jfx_routine(requested_tag, working_dir):
             ver_build
             )
         print('ver_str: {}'.format(ver_str))
-        download_tarball(
-            tag_rev_uri,
-            os.path.join(
-                working_dir,
-                'downloads',
-                project_name,
-                'openjfx-{}'.format(ver_str),
-                tarball_prefix_name + '.tar.bz2'
-                ),
-            'bz2'
-            )
+        if tag_rev_uri is None:
+            logging.error("tag {} not found".format(requested_tag))
+            ret = 3
+        elif download_tarball(
+                tag_rev_uri,
+                os.path.join(
+                    working_dir,
+                    'downloads',
+                    project_name,
+                    'openjfx-{}'.format(ver_str),
+                    tarball_prefix_name + '.tar.bz2'
+                    ),
+                'bz2'
+                ) != 0:
+            ret = 3
         print()
     return ret
@@ -0,0 +1,180 @@
+
+"""
+Precompiled matchers for sets of glob (fnmatch) and regular expression
+rules
+"""
+
+import fnmatch
+
+import regex
+
+
+GLOB_MAGIC_CHARS = ('*', '?', '[')
+
+# NOTE: patterns with global inline flags, back references or named
+#       groups (names may clash) change meaning or fail to compile when
+#       put into alternation with others, so they are compiled separately
+_NOT_COMBINABLE_RE = regex.compile(
+    r'\\[1-9]|\(\?P[=<]|\(\?[a-zA-Z]+\)'
+    )
+
+
+class PathMatcher:
+    """
+    Matches strings against set of globs (fnmatch.fnmatch() semantics)
+    and regular expressions (regex.match() semantics - anchored at start
+    only).
+
+    Rules are compiled once: globs without magic chars are put into set
+    and compared literally, all other rules are joined into single
+    alternation regex where possible
+    """
+
+    def __init__(self, globs=None, regexps=None):
+
+        if globs is None:
+            globs = []
+
+        if regexps is None:
+            regexps = []
+
+        self.literals = set()
+
+        patterns = []
+
+        for i in globs:
+            if any(x in i for x in GLOB_MAGIC_CHARS):
+                patterns.append(fnmatch.translate(i))
+            else:
+                self.literals.add(i)
+
+        patterns += list(regexps)
+
+        combinable = []
+        self._compiled = []
+
+        for i in patterns:
+            # NOTE: each pattern is compiled alone first, so invalid one is
+            #       reported by itself and not as part of alternation
+            compiled = regex.compile(i)
+            if _NOT_COMBINABLE_RE.search(i) is None:
+                combinable.append((i, compiled))
+            else:
+                self._compiled.append(compiled)
+
+        if len(combinable) > 1:
+            try:
+                combined = regex.compile(
+                    '|'.join(['(?:{})'.format(x[0]) for x in combinable])
+                    )
+            except regex.error:
+                self._compiled = [x[1] for x in combinable] + self._compiled
+            else:
+                self._compiled.insert(0, combined)
+        elif len(combinable) == 1:
+            self._compiled.insert(0, combinable[0][1])
+
+        return
+
+    def is_empty(self):
+        return len(self.literals) == 0 and len(self._compiled) == 0
+
+    def match(self, value):
+        """
+        return: True if value matches any of rules
+        """
+
+        ret = value in self.literals
+
+        if not ret:
+            for i in self._compiled:
+                if i.match(value) is not None:
+                    ret = True
+                    break
+
+        return ret
+
+
+class FilterRules:
+    """
+    Precompiled filter lines in form `ACTION FUNCTION PATTERN', where
+    ACTION is `+' (add matching items of input list) or `-' (remove
+    matching items from result) and FUNCTION is `fm' (glob) or `re'
+    (regular expression). Lines are applied in order. Result starts with
+    all input items if there are no rules or first rule is `-', and empty
+    otherwise.
+
+    Consecutive lines with same action are compiled into one PathMatcher
+    """
+
+    def __init__(self, rules):
+        """
+        rules - list of (action, PathMatcher)
+        """
+        self.rules = rules
+        return
+
+    def filter(self, lst):
+        """
+        return: list of lst items passed through rules, in lst order
+        """
+
+        if len(self.rules) == 0 or self.rules[0][0] == '-':
+            passed = set(lst)
+        else:
+            passed = set()
+
+        for action, matcher in self.rules:
+            if action == '+':
+                passed |= set([x for x in lst if matcher.match(x)])
+            else:
+                passed = set([x for x in passed if not matcher.match(x)])
+
+        ret = [x for x in lst if x in passed]
+
+        return ret
+
+
+def compile_filter_lines(filter_text_or_lines):
+    """
+    return: FilterRules, or None if some line is not in form supported by
+        FilterRules, so filter must be applied by
+        wayround_i2p.utils.list.filter_list()
+    """
+
+    if isinstance(filter_text_or_lines, str):
+        filter_text_or_lines = filter_text_or_lines.splitlines()
+
+    ret = []
+
+    # NOTE: [action, globs, regexps]
+    group = None
+
+    for i in filter_text_or_lines:
+
+        if i.strip() == '':
+            continue
+
+        i_s = i.strip().split(maxsplit=2)
+
+        if (len(i_s) != 3
+                or i_s[0] not in ['+', '-']
+                or i_s[1] not in ['fm', 're']):
+            ret = None
+            break
+
+        action, function, pattern = i_s
+
+        if group is None or group[0] != action:
+            group = [action, [], []]
+            ret.append(group)
+
+        if function == 'fm':
+            group[1].append(pattern)
+        else:
+            group[2].append(pattern)
+
+    if ret is not None:
+        ret = FilterRules([(x[0], PathMatcher(x[1], x[2])) for x in ret])
+
+    return ret
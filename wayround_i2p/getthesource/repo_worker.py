@@ -1,27 +1,52 @@
 
 import logging
 import os.path
+import json
+import time
 import subprocess
 import random
 import datetime
+import threading
 import yaml
 import collections
+import concurrent.futures
 
 import wayround_i2p.utils.path
 import wayround_i2p.utils.datetime_iso8601
 
 
-def work_on_source_repository(path):
+def get_default_repo_worker_cfg():
+    ret = {
+        # count of simultaneously running upp.py/upp.sh scripts
+        'jobs': 4,
 
-    ret = 0
+        # seconds, after which upp.py/upp.sh is killed. 0 - no limit
+        'leaf_timeout': 6 * 60 * 60,
 
-    path = wayround_i2p.utils.path.abspath(path)
+        # seconds. directory, work on which successfully ended less than
+        # this time ago, is skipped
+        'staleness_window': 3 * 24 * 60 * 60
+        }
+    return ret
 
-    print("work_on_source_repository at: {}".format(path))
+
+def _datetime_iso8601_to_unix(value):
+    return wayround_i2p.utils.datetime_iso8601.from_str(value)[0].replace(
+        tzinfo=datetime.timezone.utc
+        ).timestamp()
+
+
+def read_start_stop_record(path):
+    """
+    read start_stop.yaml of path
+
+    return: None if there is no readable start_stop.yaml, else dict with
+        keys 'begin', 'end' (unix time or None) and 'status'
+    """
 
     start_stop_file_path = os.path.join(path, 'start_stop.yaml')
 
-    old_enough = True
+    ret = None
 
     if os.path.isfile(start_stop_file_path):
         with open(start_stop_file_path) as start_stop_file:
@@ -35,44 +60,168 @@ def work_on_source_repository(path):
         else:
 
             if (isinstance(start_stop_file_data, list)
-                and
-                len(start_stop_file_data) == 2
-                and
-                isinstance(start_stop_file_data[1], dict)
-                and
-                start_stop_file_data[1]['action'] == 'end'
-                and
-
-                    (
-                        (
-                            (
-                                datetime.datetime.utcnow()
-                                -
-                                wayround_i2p.utils.datetime_iso8601.from_str(
-                                    start_stop_file_data[
-                                        1]['datetime_UTC0']
-                                )[0]
-                            ) < datetime.timedelta(days=3)
-                        )
+                    and len(start_stop_file_data) != 0
+                    and isinstance(start_stop_file_data[0], dict)):
+
+                ret = {'begin': None, 'end': None, 'status': None}
 
-                    and 'status' in start_stop_file_data[1]
-                    and start_stop_file_data[1]['status'] == 0
+                try:
+                    ret['begin'] = _datetime_iso8601_to_unix(
+                        start_stop_file_data[0]['datetime_UTC0']
+                        )
 
+                    if (len(start_stop_file_data) == 2
+                            and isinstance(start_stop_file_data[1], dict)
+                            and start_stop_file_data[1]['action'] == 'end'):
+                        ret['end'] = _datetime_iso8601_to_unix(
+                            start_stop_file_data[1]['datetime_UTC0']
+                            )
+                        ret['status'] = start_stop_file_data[1].get(
+                            'status',
+                            None
                             )
-                    ):
-                old_enough = False
+                except:
+                    logging.exception("error")
+                    ret = None
 
-            del start_stop_file_data
-            del start_stop_file_txt
+    return ret
 
-    if not old_enough:
-        print("not old enough")
-        ret = 2
 
-    else:
+def is_record_due(record, staleness_window):
+    """
+    record - read_start_stop_record() result or FreshnessIndex record
+
+    return: False, if last work ended successfully less than
+        staleness_window seconds ago
+    """
+    return (record is None
+            or record['end'] is None
+            or record['status'] != 0
+            or time.time() - record['end'] >= staleness_window)
+
+
+def is_old_enough(path, staleness_window=None):
+    """
+    False, if last work on path ended successfully less than
+    staleness_window seconds (default from get_default_repo_worker_cfg())
+    ago
+    """
+
+    if staleness_window is None:
+        staleness_window = get_default_repo_worker_cfg()['staleness_window']
+
+    return is_record_due(read_start_stop_record(path), staleness_window)
+
 
-        start_stop_file = open(start_stop_file_path, 'w')
+class FreshnessIndex:
+    """
+    wrogts_freshness_index.json in root of tree: last begin, end (unix
+    time) and status of work on each directory of tree, so freshness of
+    them is known from single file read, without parsing start_stop.yaml
+    of each directory. start_stop.yaml is still written and is read only
+    for directories not in index yet.
 
+    index is saved not more often than each INDEX_SAVE_INTERVAL seconds
+    and on close
+    """
+
+    INDEX_SAVE_INTERVAL = 10
+
+    def __init__(self, root_path, staleness_window):
+
+        self.root_path = root_path
+        self.staleness_window = staleness_window
+
+        self.filename = os.path.join(
+            root_path,
+            'wrogts_freshness_index.json'
+            )
+
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._changed = False
+
+        self._records = {}
+
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                logging.exception("error reading {}".format(self.filename))
+            else:
+                if isinstance(data, dict):
+                    self._records = data
+
+        return
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root_path)
+
+    def get(self, path):
+        """
+        return: record of path (see read_start_stop_record()) or None
+        """
+
+        key = self._key(path)
+
+        with self._lock:
+            ret = self._records.get(key, None)
+
+        if ret is None:
+            ret = read_start_stop_record(path)
+            if ret is not None:
+                with self._lock:
+                    self._records[key] = ret
+                    self._changed = True
+
+        return ret
+
+    def is_due(self, path):
+        return is_record_due(self.get(path), self.staleness_window)
+
+    def set_begin(self, path):
+        with self._lock:
+            self._records[self._key(path)] = {
+                'begin': time.time(),
+                'end': None,
+                'status': None
+                }
+            self._changed = True
+        self._save_if_time()
+        return
+
+    def set_end(self, path, status):
+        with self._lock:
+            rec = self._records.setdefault(
+                self._key(path),
+                {'begin': None, 'end': None, 'status': None}
+                )
+            rec['end'] = time.time()
+            rec['status'] = status
+            self._changed = True
+        self._save_if_time()
+        return
+
+    def _save_if_time(self):
+        if time.monotonic() - self._last_save >= self.INDEX_SAVE_INTERVAL:
+            self.save()
+        return
+
+    def save(self):
+        with self._lock:
+            if self._changed:
+                tmp_filename = self.filename + '.tmp'
+                with open(tmp_filename, 'w') as f:
+                    json.dump(self._records, f, sort_keys=True)
+                os.replace(tmp_filename, self.filename)
+                self._changed = False
+            self._last_save = time.monotonic()
+        return
+
+
+def write_start_stop_begin(path):
+    with open(os.path.join(path, 'start_stop.yaml'), 'w') as start_stop_file:
         start_stop_file.write(
             yaml.dump([
                 collections.OrderedDict(
@@ -86,113 +235,481 @@ def work_on_source_repository(path):
                     )
                 ])
             )
+    return
+
+
+def write_start_stop_end(path, status, additional=None):
+    """
+    additional - dict with additional values to write
+    """
+
+    data = collections.OrderedDict(
+        {
+            'action': 'end',
+            'datetime_UTC0':
+            wayround_i2p.utils.datetime_iso8601.to_str(
+                datetime.datetime.utcnow()
+                ),
+            'status': status
+        }
+        )
+
+    if additional is not None:
+        data.update(additional)
+
+    with open(os.path.join(path, 'start_stop.yaml'), 'a') as start_stop_file:
+        start_stop_file.write(yaml.dump([data]))
+
+    return
+
+
+class _LogFile:
+    """
+    text file written by many workers. writes are done under lock and
+    file is flushed after each write, so the log can be followed while
+    leaves are running
+    """
+
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._f = open(filename, 'w')
+        return
+
+    def write(self, txt):
+        with self._lock:
+            self._f.write(txt)
+            self._f.flush()
+        return
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+        return
+
+
+class TreeWalkingStatusLog:
+    """
+    wrogts_tree_walking_status_log.txt of `tree' directory
+    """
+
+    def __init__(self, path, lst_dirs):
+
+        self.lst_dirs = lst_dirs
+
+        # NOTE: position of each dir in order (starting from 1)
+        self._positions = {}
+        for i, name in enumerate(lst_dirs, 1):
+            self._positions[name] = i
+
+        self._f = _LogFile(
+            os.path.join(
+                path,
+                'wrogts_tree_walking_status_log.txt'
+                )
+            )
+
+        lines = [
+            "this file is created at {}\n".format(datetime.datetime.now()),
+            " the path is {}\n".format(path),
+            " (note: below count is starting from 1 (one))\n",
+            " (note: datetime is local UTC time\n",
+            " order:\n"
+            ]
+
+        for i, name in enumerate(lst_dirs, 1):
+            lines.append(" ({:>5}) {}\n".format(str(i), name))
+
+        self._f.write(''.join(lines))
+        return
+
+    def entering(self, name):
+        self._f.write(
+            " ({:>5} of {:>5}) (time: {}) going to enter: {}\n".format(
+                str(self._positions[name]),
+                str(len(self.lst_dirs)),
+                datetime.datetime.now(),
+                name
+                )
+            )
+        return
+
+    def exited(self, name, exit_code, duration):
+        self._f.write(
+            " ({:>5} of {:>5}) (time: {}) exited: {}"
+            " (exit code: {}, took: {:.1f}s)\n".format(
+                str(self._positions[name]),
+                str(len(self.lst_dirs)),
+                datetime.datetime.now(),
+                name,
+                exit_code,
+                duration
+                )
+            )
+        return
+
+    def close(self):
+        self._f.write("closing file at {}\n".format(datetime.datetime.now()))
+        self._f.close()
+        return
+
+
+class TreeWalkingEvents:
+    """
+    wrogts_tree_walking_events.jsonl in root of walked tree: one JSON
+    object per line, for monitoring tools. each object has `event' and
+    `time' (unix time) keys. events:
+
+        run_begin - path
+        skip - path (not old enough)
+        enter - path (upp.py/upp.sh started)
+        exit - path, exit_code (null if killed by timeout), duration
+        run_end - path, leaves (count), duration
+    """
+
+    def __init__(self, path):
+        self._f = _LogFile(
+            os.path.join(path, 'wrogts_tree_walking_events.jsonl')
+            )
+        return
+
+    def event(self, name, **kwargs):
+        data = {'event': name, 'time': time.time()}
+        data.update(kwargs)
+        self._f.write(json.dumps(data, sort_keys=True) + '\n')
+        return
+
+    def close(self):
+        self._f.close()
+        return
+
+
+class _RepoDir:
+    """
+    directory of source repository tree, which work is begun on
+    """
+
+    def __init__(self, path, parent):
+        self.path = path
+        self.parent = parent
+
+        # TreeWalkingStatusLog for `tree' directories
+        self.status_log = None
+
+        # count of not finished leaves under this directory (itself
+        # including)
+        self.pending = 0
 
-        start_stop_file.flush()
+        # for leaves: command to run
+        self.command = None
 
-        print("getting file list")
+        # True if this leaf or any leaf under this directory failed or
+        # was killed. such directories are ended with non-zero status,
+        # so they are not skipped by next run
+        self.failed = False
+
+        # unix time of end of previous work on directory (None - never
+        # ended)
+        self.last_end = None
+        return
+
+
+def discover_leaves(path, leaves, index, parent=None, events=None):
+    """
+    walk tree of directories, beginning (start_stop.yaml) work on ones,
+    which are old enough. directories with upp.py or upp.sh are
+    appended to leaves, work on them is begun when they are started by
+    _run_leaves()
+
+    index - FreshnessIndex of tree
+    events - TreeWalkingEvents
+
+    return: _RepoDir or None if path is not old enough
+    """
+
+    path = wayround_i2p.utils.path.abspath(path)
+
+    ret = None
+
+    record = index.get(path)
+
+    if not is_record_due(record, index.staleness_window):
+        print("not old enough: {}".format(path))
+        if events is not None:
+            events.event('skip', path=path)
+
+    else:
+
+        ret = _RepoDir(path, parent)
+
+        if record is not None:
+            ret.last_end = record['end']
 
         lst = os.listdir(path)
 
         lst_files = []
 
-        print("unlisting normal files")
         for i in range(len(lst) - 1, -1, -1):
             j = wayround_i2p.utils.path.join(path, lst[i])
             if not os.path.isdir(j):
                 lst_files.append(lst[i])
                 del lst[i]
 
-        print("sorting list")
         lst.sort()
         lst_files.sort()
         lst_dirs = lst
         del lst
 
-        print("searching tree, upp.py or upp.sh under: {}".format(path))
         if 'tree' in lst_files:
-            print("   found tree")
+            _begin_dir(path, index)
+
             random.shuffle(lst_dirs)
-            f = open(
-                os.path.join(
-                    path,
-                    'wrogts_tree_walking_status_log.txt'),
-                'w')
-            f.write(
-                "this file is created at {}\n".format(
-                    datetime.datetime.now()))
-            f.write(" the path is {}\n".format(path))
-            f.write(" (note: below count is starting from 1 (one))\n")
-            f.write(" (note: datetime is local UTC time\n")
-            f.flush()
-
-            f.write(" order:\n")
+            ret.status_log = TreeWalkingStatusLog(path, lst_dirs)
 
             for i in lst_dirs:
-                f.write(
-                    " ({:>5}) {}\n".format(
-                        str(lst_dirs.index(i) + 1),
-                        i
-                        )
+                child = discover_leaves(
+                    wayround_i2p.utils.path.join(path, i),
+                    leaves,
+                    index,
+                    ret,
+                    events
                     )
+                if child is not None and child.command is None:
+                    ret.status_log.entering(i)
 
-            f.flush()
-
-            for i in lst_dirs:
-                f.write(
-                    " ({:>5} of {:>5}) (time: {}) going to enter: {}\n".format(
-                        str(lst_dirs.index(i) + 1),
-                        str(len(lst_dirs)),
-                        datetime.datetime.now(),
-                        i
-                        )
-                    )
-                f.flush()
-                j = wayround_i2p.utils.path.join(path, i)
-                print("   discending into: {}".format(j))
-                work_on_source_repository(j)
-                print("   recursion exited from: {}".format(j))
-            f.write("closing file at {}\n".format(datetime.datetime.now()))
-            f.close()
         elif 'upp.py' in lst_files:
-            print("   starting upp.py")
-            file_ = wayround_i2p.utils.path.join(path, 'upp.py')
-            p = subprocess.Popen(
-                ['python3', file_],
-                cwd=path
-                )
-            print("   ...waiting...")
-            p_ret = p.wait()
-            print("      {} exited with {}".format(file_, p_ret))
+            ret.command = [
+                'python3',
+                wayround_i2p.utils.path.join(path, 'upp.py')
+                ]
+
         elif 'upp.sh' in lst_files:
-            print("   starting upp.sh")
-            file_ = wayround_i2p.utils.path.join(path, 'upp.sh')
-            p = subprocess.Popen(
-                ['bash', file_],
-                cwd=path
-                )
-            print("   ...waiting...")
-            p_ret = p.wait()
-            print("      {} exited with {}".format(file_, p_ret))
+            ret.command = [
+                'bash',
+                wayround_i2p.utils.path.join(path, 'upp.sh')
+                ]
+
         else:
-            print("   nothing found")
-            print("    exiting")
+            _begin_dir(path, index)
+            print("nothing found in: {}".format(path))
 
-        start_stop_file.write(
-            yaml.dump([
-                collections.OrderedDict(
-                    {
-                        'action': 'end',
-                        'datetime_UTC0':
-                        wayround_i2p.utils.datetime_iso8601.to_str(
-                            datetime.datetime.utcnow()
-                            ),
-                        'status': ret
-                    }
-                    )
-                ])
+        if ret.command is not None:
+            leaves.append(ret)
+            node = ret
+            while node is not None:
+                node.pending += 1
+                node = node.parent
+
+        elif ret.pending == 0:
+            # NOTE: nothing to wait for
+            _finish_dir(ret, None, index)
+
+    return ret
+
+
+def _begin_dir(path, index):
+    write_start_stop_begin(path)
+    index.set_begin(path)
+    return
+
+
+def _finish_dir(repo_dir, exit_code, index):
+    """
+    exit_code - exit code of upp.py/upp.sh (None if it was killed), is
+        written for leaves only
+
+    status is 1 if repo_dir.failed, else 0
+    """
+    if repo_dir.status_log is not None:
+        repo_dir.status_log.close()
+    additional = None
+    if repo_dir.command is not None:
+        additional = {'exit_code': exit_code}
+    status = 0
+    if repo_dir.failed:
+        status = 1
+    write_start_stop_end(repo_dir.path, status, additional)
+    index.set_end(repo_dir.path, status)
+    return
+
+
+def _run_leaf(leaf, timeout):
+    """
+    return: exit code or None if leaf is killed by timeout
+    """
+
+    print("starting: {}".format(' '.join(leaf.command)))
+
+    p = subprocess.Popen(leaf.command, cwd=leaf.path)
+
+    if timeout == 0:
+        timeout = None
+
+    try:
+        ret = p.wait(timeout)
+    except subprocess.TimeoutExpired:
+        logging.error(
+            "{} is working longer than {}s. killing".format(
+                leaf.command[1],
+                timeout
+                )
+            )
+        p.terminate()
+        try:
+            p.wait(10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+        ret = None
+
+    print("{} exited with {}".format(leaf.command[1], ret))
+
+    return ret
+
+
+def _run_leaves(leaves, jobs, leaf_timeout, events, index):
+    """
+    leaves, which were not run for longest time (or never ended), are
+    run first
+    """
+
+    finish_lock = threading.Lock()
+
+    def leaf_job(leaf):
+
+        started = time.monotonic()
+
+        parent_log = None
+        name = os.path.basename(leaf.path)
+        if leaf.parent is not None:
+            parent_log = leaf.parent.status_log
+
+        if parent_log is not None:
+            parent_log.entering(name)
+
+        events.event('enter', path=leaf.path)
+
+        try:
+            # NOTE: begin is written only now, so queued leaves, which
+            #       never started (run is interrupted), keep their
+            #       previous record
+            _begin_dir(leaf.path, index)
+            exit_code = _run_leaf(leaf, leaf_timeout)
+        except:
+            logging.exception("error running {}".format(leaf.command))
+            exit_code = None
+
+        duration = time.monotonic() - started
+
+        if parent_log is not None:
+            parent_log.exited(name, exit_code, duration)
+
+        events.event(
+            'exit',
+            path=leaf.path,
+            exit_code=exit_code,
+            duration=duration
+            )
+
+        with finish_lock:
+            node = leaf
+            while node is not None:
+                if exit_code != 0:
+                    node.failed = True
+                node.pending -= 1
+                if node.pending == 0:
+                    _finish_dir(node, exit_code, index)
+                node = node.parent
+
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs
+            ) as executor:
+        for i in concurrent.futures.as_completed(
+                [
+                    executor.submit(leaf_job, i)
+                    for i in sorted(
+                        leaves,
+                        key=lambda x: (
+                            x.last_end is not None,
+                            x.last_end or 0
+                            )
+                        )
+                    ]
+                ):
+            i.result()
+
+    return
+
+
+def work_on_source_repository(
+        path,
+        jobs=None,
+        leaf_timeout=None,
+        staleness_window=None
+        ):
+    """
+    find all directories with upp.py or upp.sh under path (descending
+    into subdirectories of directories with `tree' file) and run them
+    on pool of `jobs' workers, killing ones running longer than
+    leaf_timeout seconds (0 - no limit). directories, work on which ended
+    successfully less than staleness_window seconds ago, are skipped.
+    stalest leaves are run first
+
+    jobs, leaf_timeout and staleness_window defaults are taken from
+    get_default_repo_worker_cfg()
+    """
+
+    cfg = get_default_repo_worker_cfg()
+
+    if jobs is None:
+        jobs = cfg['jobs']
+
+    if leaf_timeout is None:
+        leaf_timeout = cfg['leaf_timeout']
+
+    if staleness_window is None:
+        staleness_window = cfg['staleness_window']
+
+    jobs = max(1, int(jobs))
+
+    ret = 0
+
+    path = wayround_i2p.utils.path.abspath(path)
+
+    print("work_on_source_repository at: {}".format(path))
+
+    print("searching tree, upp.py or upp.sh under: {}".format(path))
+
+    run_started = time.monotonic()
+
+    events = TreeWalkingEvents(path)
+    events.event('run_begin', path=path)
+
+    index = FreshnessIndex(path, staleness_window)
+
+    leaves = []
+
+    try:
+        root = discover_leaves(path, leaves, index, events=events)
+
+        if root is None:
+            ret = 2
+
+        else:
+            print("found {} directories to work on".format(len(leaves)))
+            _run_leaves(leaves, jobs, leaf_timeout, events, index)
+
+        events.event(
+            'run_end',
+            path=path,
+            leaves=len(leaves),
+            duration=time.monotonic() - run_started
             )
 
-        start_stop_file.close()
+    finally:
+        index.save()
+        events.close()
 
     print("work_on_source_repository exiting from: {}".format(path))
 
@@ -7,6 +7,14 @@ import datetime
 import wayround_i2p.utils.path
 import wayround_i2p.utils.log
 
+import wayround_i2p.getthesource.http_pool
+import wayround_i2p.getthesource.ftp_listing
+import wayround_i2p.getthesource.crawl_store
+
+
+# NOTE: providers walk up to 8 directories of same host at once
+HTTP_POOL_MAX_IDLE_PER_HOST = 8
+
 
 class URIExplorer:
 
@@ -38,6 +46,40 @@ class URIExplorer:
 
         self.cache_dir = os.path.expanduser(self.cache_dir)
 
+        crawl_store_filename = wayround_i2p.utils.path.join(
+            self.cache_dir,
+            'crawl.sqlite'
+            )
+
+        # NOTE: old YAML caches are orphaned after crawl store is created
+        if not os.path.isfile(crawl_store_filename):
+            removed = (
+                wayround_i2p.getthesource.crawl_store.remove_old_yaml_caches(
+                    self.cache_dir
+                    )
+                )
+            if removed != 0:
+                self.logger.info(
+                    "removed {} old YAML cache file(s) from {}".format(
+                        removed,
+                        self.cache_dir
+                        )
+                    )
+
+        self.crawl_store = wayround_i2p.getthesource.crawl_store.CrawlStore(
+            crawl_store_filename
+            )
+
+        # NOTE: get_provider() makes new provider object on each call, so
+        #       keep-alive connections are kept here and shared by all
+        #       providers, instead of being lost with provider objects
+        self.http_pool = wayround_i2p.getthesource.http_pool.ConnectionPool(
+            max_idle_per_host=HTTP_POOL_MAX_IDLE_PER_HOST
+            )
+        self.ftp_pool = (
+            wayround_i2p.getthesource.ftp_listing.FTPConnectionPool()
+            )
+
         self.simple_config = simple_config
 
         self.providers = []